@@ -15,60 +15,16 @@
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from pathlib import Path
+import json
 import numpy as np
 from time import time
-from multiprocessing import get_context
-from math import ceil, isclose
+from math import ceil
+from multiprocessing import shared_memory
 import matplotlib.pyplot as plt
 
-
-ctx = get_context('spawn')
-
-event = ctx.Event()
-
-# Compute frequencies given list of alleles
-def allele_frequency(alleles):
-    freq = 0
-    num_alleles = 0
-
-    for a in alleles:
-        if a != 9:
-            freq += (2 - a) / 2
-            num_alleles += 1
-
-    if num_alleles == 0:
-        return -1
-
-    return freq / num_alleles
-
-# Compute frequencies of a population
-def population_allele_frequencies(file_path, num_snp, pop_indices, allele_freqs):
-    with file_path.open(mode = 'r', encoding = 'utf-8') as file:
-        for index, row in enumerate(file):
-            allele_freqs[index] = allele_frequency([int(row[i]) for i in pop_indices])
-            if index == num_snp - 1 or event.is_set():
-                break
-
-def population_allele_frequencies_packed(file_path, block_size, num_snp, pop_indices, allele_freqs):
-    # Open .geno file in binary mode for reading
-    with file_path.open(mode = 'rb') as file:
-        # Skip header
-        file.seek(block_size)
-        # Read block by block
-        for index in range(num_snp):
-            # Read next block
-            block = file.read(block_size)
-            # Get block's bits array
-            bits = np.unpackbits(np.frombuffer(block, dtype = 'uint8'))
-            # Transform from binary to decimal
-            alleles = 2 * bits[::2] + bits[1::2]
-            # Map 3 into 9
-            alleles[alleles == 3] = 9
-            # Compute frequencies for selected populations
-            allele_freqs[index] = allele_frequency([int(alleles[i]) for i in pop_indices])
-            # Abort computation?
-            if event.is_set():
-                break
+from gui.kernels import ctx, event, chunk_bytes, difference_product, gram_zero, top_entries, bootstrap_task, admixture_scan_task, f4_scan_task, allele_counts_task, init_worker
+from gui.frequency_matrix import FrequencyMatrix
+from gui.frequency_cache import FrequencyCache
 
 
 class Core:
@@ -79,11 +35,13 @@ class Core:
         self.ind_file_path = Path('')
         self.snp_file_path = Path('')
         self.pops_file_path = Path('')
+        self.models_file_path = Path('')
 
         self.geno_file_ascii = True
         self.num_ind = 0
         self.num_snp = 0
         self.block_size = 48
+        self.geno_row_size = 0
 
         self.num_geno_cols = []
         self.num_ind_rows = 0
@@ -95,13 +53,32 @@ class Core:
         self.avail_pops = []
         self.avail_pops_indices = {}
         self.snp_names = []
+        # Chromosome codes and positions of SNPs, converted to arrays once parsed
+        self.snp_chromosomes = np.zeros(0, dtype = int)
+        self.snp_positions = np.zeros(0, dtype = 'int64')
         self.parsed_pops = []
         self.selected_pops = []
 
         self.num_procs = 1
+        self.pool = None
+        self.pool_size = 0
         self.num_alleles = 0
         self.num_valid_alleles = 0
-        self.allele_frequencies = {}
+        self.allele_frequencies = FrequencyMatrix([], np.zeros((2, 0, 0), dtype = 'uint16'))
+        self.counts_dtype = np.dtype('uint16')
+        self.pairwise_complete = False
+        # Skip SNPs with equal frequencies in all selected populations in products, and number of them
+        self.compact_snps = False
+        self.num_uninformative_alleles = 0
+
+        # Physical length of the blocks of SNPs of the block jackknife
+        self.jackknife_block_size = 5000000
+        # Maximum size of the products of all selected populations within every jackknife block, (blocks x populations x populations) doubles,
+        # three times as many in pairwise mode, above which adjacent blocks are merged
+        self.max_products_bytes = 4 * 1024 ** 3
+        self.frequency_cache = FrequencyCache()
+        self.frequencies_source = None
+        self.frequencies_individuals = {}
 
         self.hybrid_pop = ''
         self.parent1_pop = ''
@@ -125,6 +102,8 @@ class Core:
         self.cosine_post_jl = 0
         self.angle_post_jl = 0
         self.percentage_post_jl = 0
+        self.alpha_jackknife_error = 0
+        self.angle_post_jl_jackknife_error = 0
         self.alpha_ratio = []
         self.alpha_ratio_avg = 0
         self.alpha_ratio_std_dev = 0
@@ -132,15 +111,51 @@ class Core:
         self.alpha_ratio_hist_bins = 20
         self.num_cases = 0
 
+        # Number of auxiliary pairs above which sums over pairs are accumulated by blocks of pairs instead of over arrays of all pairs,
+        # keeping then the f4 points of a uniform sample of at most a given number of pairs, or of all pairs if none
+        self.max_aux_pairs = 500000
+        self.max_f4_points = 10000
+        # Pairs of auxiliary populations of the f4 points, as indices of computed auxiliary populations
+        self.f4_pairs = (np.zeros(0, dtype = int), np.zeros(0, dtype = int))
+        # Range of the f4-ratios of all auxiliary pairs if their sums were accumulated by blocks of pairs, their histogram being accumulated over it
+        self.alpha_ratio_range = None
+
+        # Contributions of the pairs of all candidate auxiliary populations of a model, and their sums over the pairs
+        # of the auxiliary populations in use, updated as auxiliary populations are added or removed
+        self.aux_contributions = None
+
+        # Fraction of the median f2 distance of auxiliary pairs under which auxiliary populations are taken as near-identical
+        self.near_duplicate_f2 = 0.001
+
+        # Alpha post JL, admixture angle post JL and f4-ratio average leaving out every auxiliary population, as rows
+        self.aux_influence = []
+
         self.pca_pops = []
         self.principal_components = []
         self.explained_variance = []
         self.pca_eigenvalues = []
 
         self.bootstrap = False
+        # Number of bootstrap replicates, evaluated in tasks of a maximum size, and seed of their random streams, drawn anew if none
+        self.bootstrap_replicates = 1000
+        self.bootstrap_task_size = 1000
+        self.bootstrap_seed = None
+        self.bootstrap_entropy = 0
         self.std_dev_alpha = 0
         self.std_dev_angle = 0
 
+        # Quadruples of greatest f4 statistics, as rows (A, B, C, D, f4, angle, f4 standard error)
+        self.f4_scan_results = []
+        # Number of tasks of the last f4 scan, against which its progress is reported
+        self.num_f4_scan_tasks = 0
+
+        # Admixture models (hybrid, parent 1, parent 2, auxiliary populations) evaluated in a batch, and their results
+        self.models = []
+        self.models_results = []
+
+        # Admixture models scanned, as rows (hybrid, parent 1, parent 2, angle post JL, alpha post JL, f3 test) ranked by angle
+        self.scan_results = []
+
     def set_geno_file_path(self, file_path):
         self.geno_file_path = Path(file_path)
 
@@ -153,6 +168,9 @@ class Core:
     def set_pops_file_path(self, file_path):
         self.pops_file_path = Path(file_path)
 
+    def set_models_file_path(self, file_path):
+        self.models_file_path = Path(file_path)
+
     def is_geno_file_ascii(self):
         buffer = bytearray(64 * 1024)
         with self.geno_file_path.open(mode = 'rb') as file:
@@ -179,14 +197,44 @@ class Core:
     def geno_table_shape(self, progress_callback):
         self.num_snp = 0
         self.num_geno_cols = []
+        self.geno_row_size = 0
 
-        with self.geno_file_path.open(mode = 'r', encoding = 'utf-8') as file:
-            for row in file:
-                row = row.rstrip()
-                self.num_geno_cols.append(len(row))
-                if self.num_snp % 1000 == 0:
-                    progress_callback('geno', f'Number of rows: {self.num_snp}')
-                self.num_snp += 1
+        row_start = 0
+        position = 0
+        last_byte = ord('\n')
+
+        with self.geno_file_path.open(mode = 'rb') as file:
+            while True:
+                chunk = np.frombuffer(file.read(chunk_bytes), dtype = 'uint8')
+                if chunk.size == 0:
+                    break
+
+                # Row widths from line break positions, excluding carriage returns
+                line_breaks = np.flatnonzero(chunk == ord('\n'))
+                row_ends = line_breaks + position
+                row_starts = np.concatenate(([row_start], row_ends[:-1] + 1))
+                prev_bytes = np.where(line_breaks > 0, chunk[line_breaks - 1], last_byte)
+                self.num_geno_cols.append(row_ends - row_starts - (prev_bytes == ord('\r')))
+
+                if row_ends.size > 0:
+                    row_start = row_ends[-1] + 1
+                    # Number of bytes per row including line break
+                    if self.geno_row_size == 0:
+                        self.geno_row_size = int(row_ends[0]) + 1
+                position += chunk.size
+                last_byte = chunk[-1]
+
+                self.num_snp += row_ends.size
+                progress_callback('geno', f'Number of rows: {self.num_snp}')
+
+        # Last row without line break
+        if position > row_start:
+            self.num_geno_cols.append(np.array([position - row_start - int(last_byte == ord('\r'))]))
+            self.num_snp += 1
+            if self.geno_row_size == 0:
+                self.geno_row_size = position + 1
+
+        self.num_geno_cols = np.concatenate(self.num_geno_cols) if len(self.num_geno_cols) > 0 else np.zeros(0, dtype = int)
 
         self.num_alleles = self.num_snp
 
@@ -220,15 +268,20 @@ class Core:
 
         return True
 
-    # Parse .snp file containing allele names, and count number of rows
+    # Parse .snp file containing allele names, chromosomes and physical positions, and count number of rows
     def parse_snp_file(self, progress_callback):
         self.snp_names = []
+        chromosome_codes = {}
+        chromosomes = []
+        positions = []
         self.num_snp_rows = 0
 
         with self.snp_file_path.open(mode = 'r', encoding = 'utf-8') as file:
             for row in file:
                 columns = row.split()
                 self.snp_names.append(columns[0])
+                chromosomes.append(chromosome_codes.setdefault(columns[1] if len(columns) > 1 else '', len(chromosome_codes)))
+                positions.append(int(float(columns[3])) if len(columns) > 3 else 0)
 
                 if self.num_snp_rows % 1000 == 0:
                     progress_callback('snp', f'Number of rows: {self.num_snp_rows}')
@@ -236,10 +289,14 @@ class Core:
 
         progress_callback('snp', f'Number of rows: {self.num_snp_rows}')
 
+        # Jackknife blocks are found over these arrays at every computation of frequencies
+        self.snp_chromosomes = np.array(chromosomes, dtype = int)
+        self.snp_positions = np.array(positions, dtype = 'int64')
+
         return True
 
     def check_geno_file(self):
-        return all(nc == self.num_geno_cols[0] for nc in self.num_geno_cols)
+        return self.num_geno_cols.size > 0 and bool(np.all(self.num_geno_cols == self.num_geno_cols[0]))
 
     def check_ind_and_geno(self):
         return self.num_ind_rows == self.num_geno_cols[0]
@@ -285,6 +342,59 @@ class Core:
 
         return True
 
+    # Parse admixture models file, a JSON list of objects with hybrid, parent1, parent2 and aux keys,
+    # or rows of hybrid, parent 1, parent 2 and auxiliary populations separated by tabs, spaces or commas
+    # Models without auxiliary populations use all other populations of all models, which are selected
+    def parse_models_file(self, progress_callback):
+        self.models = []
+
+        with self.models_file_path.open(mode = 'r', encoding = 'utf-8') as file:
+            if self.models_file_path.suffix.lower() == '.json':
+                # Malformed files, or models without a hybrid and two parent populations given as names, are rejected
+                try:
+                    for model in json.load(file):
+                        pops = [model['hybrid'], model['parent1'], model['parent2']]
+                        aux_pops = model.get('aux', [])
+                        if isinstance(aux_pops, str) or not all(isinstance(pop, str) for pop in pops + list(aux_pops)):
+                            return False
+                        self.models.append((*pops, list(aux_pops)))
+                except (KeyError, TypeError, AttributeError, json.JSONDecodeError):
+                    return False
+            else:
+                for row in file:
+                    columns = row.replace(',', ' ').split()
+                    if len(columns) == 0 or columns[0].startswith('#'):
+                        continue
+                    if len(columns) < 3:
+                        return False
+                    self.models.append((columns[0], columns[1], columns[2], columns[3:]))
+
+        self.parsed_pops = list(dict.fromkeys(pop for hybrid, parent1, parent2, aux_pops in self.models for pop in [hybrid, parent1, parent2] + aux_pops))
+
+        progress_callback('pops', f'Number of models: {len(self.models)}, number of pops: {len(self.parsed_pops)}')
+
+        return True
+
+    # Check that every model is made of distinct selected populations, with at least 4 auxiliary populations
+    def check_models(self):
+        errors = []
+        for index, (hybrid, parent1, parent2, aux_pops) in enumerate(self.models):
+            pops = [hybrid, parent1, parent2] + self.model_aux_pops(index)
+            if any(pop not in self.selected_pops for pop in pops):
+                errors.append(f'Model {index + 1}: populations missing from .ind file: {','.join(pop for pop in pops if pop not in self.selected_pops)}')
+            elif len(set(pops)) < len(pops):
+                errors.append(f'Model {index + 1}: repeated populations')
+            elif len(pops) < 7:
+                errors.append(f'Model {index + 1}: less than 4 auxiliary populations')
+        return errors
+
+    # Auxiliary populations of a model, all other selected populations if none
+    def model_aux_pops(self, index):
+        hybrid, parent1, parent2, aux_pops = self.models[index]
+        if len(aux_pops) > 0:
+            return list(aux_pops)
+        return [pop for pop in self.selected_pops if pop not in (hybrid, parent1, parent2)]
+
     def check_parsed_pops(self):
         if len(self.parsed_pops) > 0 and len(self.avail_pops) > 0:
             missing_pops = [pop for pop in self.parsed_pops if pop not in self.avail_pops]
@@ -311,93 +421,237 @@ class Core:
     def stop_computation(self):
         event.set()
 
+    def computation_stopped(self):
+        return event.is_set()
+
     def set_num_procs(self, procs):
         if procs < 1: procs = 1
         self.num_procs = procs
 
-    # Parallel compute frequencies of all populations
+    # Get pool of worker processes, kept alive while the number of processes does not change
+    def worker_pool(self):
+        if self.pool is None or self.pool_size != self.num_procs:
+            self.close_pool()
+            self.pool = ctx.Pool(self.num_procs, initializer = init_worker, initargs = (event,))
+            self.pool_size = self.num_procs
+        return self.pool
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    # Store allele counts as 16-bit integers, unless a population has too many individuals
+    def set_counts_dtype(self):
+        max_called = 2 * max([len(indices) for indices in self.avail_pops_indices.values()], default = 0)
+        self.counts_dtype = np.promote_types('uint16', np.min_scalar_type(max_called))
+
+    # Persistent cache of computed frequencies
+    def set_cache(self, enabled, cache_dir = None, max_size = None):
+        self.frequency_cache.enabled = enabled
+        if cache_dir is not None:
+            self.frequency_cache.set_cache_dir(cache_dir)
+        if max_size is not None:
+            self.frequency_cache.set_max_size(max_size)
+
+    # Bounds of the blocks of SNPs of the block jackknife, split at every change of chromosome or block of physical positions,
+    # merging adjacent blocks if the products of the selected populations within every block would exceed their maximum size
+    def jackknife_blocks(self):
+        chromosomes = self.snp_chromosomes[:self.num_alleles]
+        positions = self.snp_positions[:self.num_alleles] // self.jackknife_block_size
+        splits = np.flatnonzero((chromosomes[1:] != chromosomes[:-1]) | (positions[1:] != positions[:-1])) + 1
+        bounds = np.concatenate(([0], splits, [self.num_alleles])).astype(int)
+
+        num_blocks = bounds.size - 1
+        max_blocks = max(2, self.max_products_bytes // (8 * (3 if self.pairwise_complete else 1) * max(1, len(self.selected_pops)) ** 2))
+        if num_blocks > max_blocks:
+            bounds = bounds[np.round(np.linspace(0, num_blocks, max_blocks + 1)).astype(int)]
+
+        return bounds
+
+    # Compute every f-statistic over the SNPs observed in its populations, instead of dropping SNPs missing in any selected population
+    def set_pairwise_complete(self, pairwise):
+        self.pairwise_complete = pairwise
+        self.allele_frequencies.set_pairwise(pairwise)
+        self.aux_contributions = None
+        self.update_snp_counts()
+
+    # Skip SNPs with equal frequencies in all selected populations when computing products, which adds nothing to their differences
+    # Normalizations of f-statistics still count them, as valid SNPs
+    def set_compact_snps(self, compact):
+        self.compact_snps = compact
+        self.allele_frequencies.set_compact(compact)
+        self.aux_contributions = None
+        self.update_snp_counts()
+
+    # Numbers of SNPs used and of monomorphic SNPs skipped in the products, if these are computed, as the way SNPs are used changes
+    def update_snp_counts(self):
+        self.num_valid_alleles = self.allele_frequencies.num_snps
+        compacted = self.compact_snps and not self.pairwise_complete and self.allele_frequencies.products is not None
+        self.num_uninformative_alleles = self.allele_frequencies.num_uninformative if compacted else 0
+
+    # Parallel compute frequencies of selected populations, reusing those already computed
     def parallel_compute_populations_frequencies(self, progress_callback):
         event.clear()
 
-        pop_indices = [self.avail_pops_indices[pop] for pop in self.selected_pops]
+        self.set_num_alleles()
+        self.set_counts_dtype()
+
+        # Populations already computed, even if deselected afterwards, keep their allele counts
+        source = (self.geno_file_path, self.ind_file_path, self.snp_file_path, self.num_alleles, self.counts_dtype)
+        if source != self.frequencies_source:
+            self.frequencies_individuals = {}
+        kept_pops = [pop for pop in self.allele_frequencies.indices if self.frequencies_individuals.get(pop) == self.avail_pops_indices.get(pop)]
+        stored_pops = [pop for pop in self.selected_pops if pop in kept_pops]
+        new_pops = [pop for pop in self.selected_pops if pop not in stored_pops]
+
+        if len(new_pops) == 0:
+            # Removing populations only drops their rows from the selection
+            self.allele_frequencies.select(self.selected_pops)
+
+            progress_callback('main', f'Frequencies of {len(self.selected_pops)} populations already computed.', 0)
+            progress_callback('progress', '', 0)
+            progress_callback(100)
+        else:
+            num_pops = len(kept_pops) + len(new_pops)
+
+            # Workers write allele counts into a shared (2 x population x SNP) matrix without locks
+            counts_memory = shared_memory.SharedMemory(create = True, size = max(1, self.counts_dtype.itemsize * 2 * num_pops * self.num_alleles))
+            allele_freqs = FrequencyMatrix(kept_pops + new_pops, np.ndarray((2, num_pops, self.num_alleles), dtype = self.counts_dtype, buffer = counts_memory.buf), counts_memory)
+            allele_freqs.select(self.selected_pops)
+            allele_freqs.set_pairwise(self.pairwise_complete)
+            allele_freqs.set_compact(self.compact_snps)
+            allele_freqs.set_blocks(self.jackknife_blocks())
+
+            # Copy stored counts and their invalid SNPs
+            if len(kept_pops) > 0:
+                allele_freqs.counts[:, allele_freqs.row_indices(kept_pops)] = self.allele_frequencies.counts[:, self.allele_frequencies.row_indices(kept_pops)]
+                for pop in kept_pops:
+                    allele_freqs.invalid[pop] = self.allele_frequencies.invalid[pop]
+
+            if not self.compute_new_populations_frequencies(allele_freqs, new_pops, progress_callback):
+                return False
 
-        num_sel_pops = len(self.selected_pops)
-        batch_size = ceil(num_sel_pops / self.num_procs)
-        index = 0
+            progress_callback('check', 'Checking and removing invalid SNPs...', 0)
 
-        self.set_num_alleles()
+            allele_freqs.find_invalid(new_pops)
+            allele_freqs.adopt_products(self.allele_frequencies, kept_pops)
 
-        allele_freqs = [ctx.Array('d', self.num_alleles) for i in range(num_sel_pops)]
+            # Adopt the shared memory block as frequencies store
+            self.allele_frequencies.release()
+            self.allele_frequencies = allele_freqs
 
-        progress_callback('main', f'Computing {self.num_alleles} frequencies per population for {num_sel_pops} populations in {batch_size} batches of {self.num_procs} parallel processes...', 0)
-        progress_callback(0)
+            self.frequencies_source = source
+            self.frequencies_individuals = {pop: self.avail_pops_indices[pop] for pop in kept_pops + new_pops}
 
-        num_indices = 0
-        t1 = time()
+        progress_callback('check', 'Checking SNPs finished.', 0)
+        progress_callback('check', f'Number of excluded SNPs: {self.allele_frequencies.num_invalid}', 1)
 
-        for batch in range(batch_size):
-            procs = []
-            computing_pops = []
-
-            for proc in range(self.num_procs):
-                if index < num_sel_pops:
-                    if self.geno_file_ascii:
-                        p = ctx.Process(target = population_allele_frequencies, args = (self.geno_file_path, self.num_alleles, pop_indices[index], allele_freqs[index]))
-                    else:
-                        p = ctx.Process(target = population_allele_frequencies_packed, args = (self.geno_file_path, self.block_size, self.num_alleles, pop_indices[index], allele_freqs[index]))
-                    procs.append(p)
-                    p.start()
-                    computing_pops.append(self.selected_pops[index])
-                    num_indices += len(pop_indices[index])
-                    index += 1
-                else:
-                    break
+        # All f-statistics are looked up from the Gram matrix of the populations, only new products are computed
+        self.allele_frequencies.gram(self.selected_pops)
+        self.aux_contributions = None
 
-            progress_callback('progress', 'Computing populations: ' + ' '.join(computing_pops), 0)
+        self.update_snp_counts()
+        if self.num_uninformative_alleles > 0:
+            progress_callback('check', f'Number of excluded SNPs: {self.allele_frequencies.num_invalid}, monomorphic SNPs skipped: {self.num_uninformative_alleles}', 1)
 
-            for p in procs:
-                p.join()
+        self.init_admixture_model()
 
-            if event.is_set():
-                break
+        return True
 
-            t2 = time()
-            elapsed_time = t2 - t1
-            elapsed_time_per_index = elapsed_time / num_indices
+    # Parallel compute frequencies of several populations into their rows of a frequency matrix
+    def compute_new_populations_frequencies(self, allele_freqs, pops, progress_callback):
+        num_sel_pops = len(allele_freqs.pops)
 
-            num_remaining_indices = sum([len(indices) for indices in pop_indices[index:]])
-            estimated_remaining_time = num_remaining_indices * elapsed_time_per_index
+        if self.geno_file_ascii:
+            header_size, row_size = 0, self.geno_row_size
+        else:
+            header_size, row_size = self.block_size, self.block_size
 
-            progress_callback('timing', f'Estimated remaining time: {self.time_format(estimated_remaining_time)}', 0)
-            progress_callback('timing', f'Elapsed time: {self.time_format(elapsed_time)}', 1)
-            progress_callback(index)
+        # Serve cached populations and compute the rest
+        cache_keys = {}
+        cached_counts = {}
+        if self.frequency_cache.enabled:
+            fingerprint = self.frequency_cache.fingerprint([self.geno_file_path, self.ind_file_path, self.snp_file_path])
+            cache_keys = {pop: self.frequency_cache.key(fingerprint, pop, self.avail_pops_indices[pop], self.num_alleles, self.counts_dtype) for pop in pops}
+            cached_counts = self.frequency_cache.load(cache_keys.values(), self.num_alleles, self.counts_dtype)
 
-        if event.is_set():
-            progress_callback('main', 'Computation stopped!', 0)
+        computed_pops = []
+        for pop in pops:
+            if cache_keys.get(pop) in cached_counts:
+                allele_freqs.counts[:, allele_freqs.indices[pop]] = cached_counts[cache_keys[pop]]
+            else:
+                computed_pops.append(pop)
+
+        pop_indices = [self.avail_pops_indices[pop] for pop in computed_pops]
+        pop_rows = allele_freqs.row_indices(computed_pops)
+
+        num_sel_ind = sum([len(indices) for indices in pop_indices])
+
+        # Split SNPs into contiguous ranges, several per process so that no process sits idle
+        shard_size = max(chunk_bytes // row_size, ceil(self.num_alleles / (4 * self.num_procs)))
+        tasks = [(self.geno_file_path, self.geno_file_ascii, header_size, row_size, start, min(start + shard_size, self.num_alleles), pop_indices, pop_rows, allele_freqs.memory.name, allele_freqs.counts.shape, self.counts_dtype) for start in range(0, self.num_alleles, shard_size) if len(computed_pops) > 0]
+
+        # Dispatch most expensive tasks first: individuals times SNPs
+        tasks.sort(key = lambda task: num_sel_ind * (task[5] - task[4]), reverse = True)
+
+        progress_callback('main', f'Computing {self.num_alleles} frequencies per population for {len(computed_pops)} populations ({num_sel_pops - len(computed_pops)} already computed or cached) in {len(tasks)} SNP ranges by {self.num_procs} parallel processes...', 0)
+        progress_callback(0)
+        progress_callback('progress', 'Computing populations: ' + ' '.join(computed_pops), 0)
+
+        t1 = time()
+
+        # Worker processes are only needed if some population is not cached
+        results = self.worker_pool().imap_unordered(allele_counts_task, tasks) if len(tasks) > 0 else []
+
+        rows = 0
+        percentage = 0
+
+        try:
+            # Workers check the cancellation token once per chunk of SNPs, so remaining tasks finish at once if stopped
+            for snp_start, snp_stop in results:
+                if event.is_set():
+                    continue
+
+                rows += snp_stop - snp_start
+                if int(100 * rows / self.num_alleles) == percentage:
+                    continue
+                percentage = int(100 * rows / self.num_alleles)
+
+                elapsed_time = time() - t1
+                estimated_remaining_time = elapsed_time * (self.num_alleles - rows) / rows
+
+                progress_callback('timing', f'Estimated remaining time: {self.time_format(estimated_remaining_time)}', 0)
+                progress_callback('timing', f'Elapsed time: {self.time_format(elapsed_time)}', 1)
+                progress_callback(percentage)
+        except Exception as error:
+            # Any failure of a worker releases the shared memory block, which would otherwise outlive the session
+            allele_freqs.release()
+
+            progress_callback('main', f'Computation failed! {error}', 0)
             progress_callback('progress', 'Allele frequencies unchanged from previous computation.', 0)
             progress_callback('timing', '', 0)
 
             return False
 
-        progress_callback('main', 'Computation finished.', 0)
-        progress_callback('progress', '', 0)
-        progress_callback('check', 'Checking and removing invalid SNPs...', 0)
+        # No process uses the shared memory block from now on
+        allele_freqs.memory.unlink()
 
-        invalid_indices = np.unique(np.array([index for freqs in allele_freqs for index, freq in enumerate(freqs.get_obj()) if freq == -1], dtype = int))
-        self.num_valid_alleles = self.num_alleles - invalid_indices.size
+        if event.is_set():
+            allele_freqs.release()
 
-        valid_allele_freqs = []
-        for i in range(len(allele_freqs)):
-            valid_allele_freqs.append(np.delete(allele_freqs[i], invalid_indices))
+            progress_callback('main', 'Computation stopped!', 0)
+            progress_callback('progress', 'Allele frequencies unchanged from previous computation.', 0)
+            progress_callback('timing', '', 0)
 
-        progress_callback('check', 'Checking SNPs finished.', 0)
-        progress_callback('check', f'Number of excluded SNPs: {len(invalid_indices)}', 1)
+            return False
 
-        self.allele_frequencies = {}
-        for index, pop in enumerate(self.selected_pops):
-            self.allele_frequencies[pop] = np.array(valid_allele_freqs[index], dtype='d')
+        self.frequency_cache.store({cache_keys[pop]: (pop, allele_freqs.counts[:, allele_freqs.indices[pop]]) for pop in computed_pops if pop in cache_keys})
 
-        self.init_admixture_model()
+        progress_callback(100)
+        progress_callback('main', 'Computation finished.', 0)
+        progress_callback('progress', '', 0)
 
         return True
 
@@ -445,18 +699,29 @@ class Core:
     def set_aux_pops(self, pops):
         self.aux_pops = [pop for pop in pops if pop != self.hybrid_pop and pop != self.parent1_pop and pop != self.parent2_pop]
 
+    # Gram matrix of the admixture model populations (hybrid, parent 1, parent 2), followed by auxiliary populations
+    def model_gram(self, aux_pops = []):
+        return self.allele_frequencies.gram([self.hybrid_pop, self.parent1_pop, self.parent2_pop] + list(aux_pops))
+
+    # Indices of the pairs (i < j) of auxiliary populations within a model Gram matrix
+    def aux_pairs(self, num_aux_pops):
+        i, j = np.triu_indices(num_aux_pops, 1)
+        return i + 3, j + 3
+
     # Computation of alpha pre JL
     def mixing_coefficient_pre_jl(self):
-        parent_diff = self.allele_frequencies[self.parent1_pop] - self.allele_frequencies[self.parent2_pop]
-        self.alpha_pre_jl = np.dot(self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent2_pop], parent_diff) / np.dot(parent_diff, parent_diff)
+        gram = self.model_gram()
+        self.alpha_pre_jl = difference_product(gram, 0, 2, 1, 2) / difference_product(gram, 1, 2, 1, 2)
 
     # Computation of admixture angle pre JL
     def admixture_angle_pre_jl(self):
-        xa = self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent1_pop]
-        xb = self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent2_pop]
+        gram = self.model_gram()
+
+        xaxa = difference_product(gram, 0, 1, 0, 1)
+        xbxb = difference_product(gram, 0, 2, 0, 2)
 
-        if np.dot(xa, xa) > 0 and np.dot(xb, xb) > 0:
-            self.cosine_pre_jl = np.dot(xa, xb) / np.sqrt(np.dot(xa, xa) * np.dot(xb, xb))
+        if xaxa > 0 and xbxb > 0:
+            self.cosine_pre_jl = difference_product(gram, 0, 1, 0, 2) / np.sqrt(xaxa * xbxb)
         else:
             self.cosine_pre_jl = 0
         self.angle_pre_jl = np.arccos(self.cosine_pre_jl) * 180 / np.pi
@@ -464,91 +729,158 @@ class Core:
 
     # Computation of f3
     def f3(self):
-        num_alleles = self.allele_frequencies[self.hybrid_pop].size
-        self.f3_test = np.dot(self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent1_pop], self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent2_pop]) / num_alleles
-
-    # Computation of f4 prime
-    def f4_prime(self, aux_pops):
-        num_aux_pops = len(aux_pops)
-        num_pairs = int(num_aux_pops * (num_aux_pops - 1) / 2)
-
-        f4ab_prime = np.zeros(num_pairs)
-        f4xb_prime = np.zeros(num_pairs)
+        gram = self.model_gram()
+        self.f3_test = difference_product(gram, 0, 1, 0, 2) / self.allele_frequencies.num_snps
 
-        ab = self.allele_frequencies[self.parent1_pop] - self.allele_frequencies[self.parent2_pop]
-        xb = self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent2_pop]
+    # Computation of f4 prime, standard f4 and f4-ratio points of all pairs of auxiliary populations, returning f4 prime (X, A) points for the angle
+    def aux_points(self):
+        i, j = self.aux_pairs(len(self.aux_pops))
+        self.f4ab_prime, self.f4xb_prime, f4xa_prime, self.f4ab_std, self.f4xb_std, self.alpha_ratio = self.aux_pair_points(self.model_gram(self.aux_pops), i, j, self.allele_frequencies.num_snps)
+        self.f4_pairs = (i - 3, j - 3)
+        self.alpha_ratio_range = None
+        return f4xa_prime
 
-        index = 0
-
-        for i in range(num_aux_pops):
-            for j in range(i + 1, num_aux_pops):
-                ij = self.allele_frequencies[aux_pops[i]] - self.allele_frequencies[aux_pops[j]]
-                norm_ij = np.linalg.norm(ij)
-                if norm_ij > 0:
-                    f4ab_prime[index] = np.dot(ab, ij) / norm_ij
-                    f4xb_prime[index] = np.dot(xb, ij) / norm_ij
-                else:
-                    f4ab_prime[index] = 0
-                    f4xb_prime[index] = 0
-                index += 1
-
-        return f4ab_prime, f4xb_prime
-
-    # Computation of f4 standard
-    def f4_std(self):
+    def get_aux_pop_pair(self, index):
+        if index < 0 or index >= self.f4_pairs[0].size:
+            return '', ''
+        return self.aux_pops_computed[self.f4_pairs[0][index]], self.aux_pops_computed[self.f4_pairs[1][index]]
+
+    # Set maximum number of f4 points kept when sums over auxiliary pairs are accumulated by blocks of pairs, all of them if none
+    def set_max_f4_points(self, num_points):
+        self.max_f4_points = num_points
+
+    # Whether sums over the pairs of a number of auxiliary populations are accumulated by blocks of pairs
+    def stream_aux_pairs(self, num_aux_pops):
+        return num_aux_pops * (num_aux_pops - 1) // 2 > self.max_aux_pairs
+
+    # Indices of the pairs (i < j) of auxiliary populations within a model Gram matrix, by blocks of consecutive rows i of about a given number of pairs,
+    # along with their indices k in the order of aux_pairs
+    def aux_pair_blocks(self, num_aux_pops, block_pairs):
+        rows = np.arange(num_aux_pops - 1)
+        row_sizes = num_aux_pops - 1 - rows
+        row_ends = np.cumsum(row_sizes)
+        row_starts = row_ends - row_sizes
+
+        start = 0
+        while start < rows.size:
+            stop = max(start + 1, np.searchsorted(row_ends, row_starts[start] + block_pairs, side = 'right'))
+            k = np.arange(row_starts[start], row_ends[stop - 1])
+            i = np.repeat(rows[start:stop], row_sizes[start:stop])
+            j = k - row_starts[i] + i + 1
+            yield k, i + 3, j + 3
+            start = stop
+
+    # f4 prime (A, B), f4 prime (X, B), f4 prime (X, A), standard f4 (A, B), standard f4 (X, B) and f4-ratio points of pairs of auxiliary populations,
+    # from the Gram matrix of the model and auxiliary populations, or from a stack of them, and their numbers of SNPs
+    def aux_pair_points(self, gram, i, j, num_snps):
+        ab_ij = difference_product(gram, 1, 2, i, j)
+        xa_ij = difference_product(gram, 0, 1, i, j)
+        xb_ij = difference_product(gram, 0, 2, i, j)
+        ij_ij = difference_product(gram, i, j, i, j)
+
+        zero = gram_zero(gram)
+        nonzero = ij_ij > zero
+        norm_ij = np.sqrt(np.where(nonzero, ij_ij, 1))
+        ratio = np.abs(ab_ij) > zero
+
+        num_snps = np.asarray(num_snps)[..., np.newaxis]
+
+        return (np.where(nonzero, ab_ij / norm_ij, 0), np.where(nonzero, xb_ij / norm_ij, 0), np.where(nonzero, xa_ij / norm_ij, 0),
+            ab_ij / num_snps, xb_ij / num_snps, np.where(ratio, xb_ij / np.where(ratio, ab_ij, 1), 0))
+
+    # Sums over the pairs of auxiliary populations behind alpha post JL, its error, the admixture angle post JL, alpha standard and f4-ratio statistics,
+    # and range of f4-ratios, accumulated by blocks of pairs from the Gram matrix of the model and auxiliary populations, or from every one of a stack
+    def accumulate_aux_pairs(self, gram, num_aux_pops, num_snps):
+        stack_shape = gram.shape[:-2]
+        block_pairs = max(1, chunk_bytes // (8 * int(np.prod(stack_shape))))
+
+        sums = np.zeros((13,) + stack_shape)
+        ratio_min = np.full(stack_shape, np.inf)
+        ratio_max = np.full(stack_shape, -np.inf)
+
+        for k, i, j in self.aux_pair_blocks(num_aux_pops, block_pairs):
+            x, y, xa, x_std, y_std, r = self.aux_pair_points(gram, i, j, num_snps)
+            r_01 = (r >= 0) & (r <= 1)
+
+            terms = (x * y, x * x, y * y, x, xa * y, xa * xa, x_std * y_std, x_std * x_std, y_std * y_std, x_std, np.where(r_01, r, 0), np.where(r_01, r * r, 0), r_01)
+            for n, term in enumerate(terms):
+                sums[n] += np.sum(term, axis = -1)
+
+            ratio_min = np.minimum(ratio_min, np.min(r, axis = -1))
+            ratio_max = np.maximum(ratio_max, np.max(r, axis = -1))
+
+        return sums, (ratio_min, ratio_max)
+
+    # Histogram of the f4-ratios of all pairs of auxiliary populations given its bin edges, and points of the pairs of given sorted indices,
+    # or of all pairs if none, accumulated by blocks of pairs from the Gram matrix of the model and auxiliary populations
+    def accumulate_aux_pair_points(self, gram, num_aux_pops, edges, sample = None):
+        counts = np.zeros(edges.size - 1, dtype = int)
+        points = [[] for n in range(7)]
+
+        for k, i, j in self.aux_pair_blocks(num_aux_pops, max(1, chunk_bytes // 8)):
+            x, y, xa, x_std, y_std, r = self.aux_pair_points(gram, i, j, self.allele_frequencies.num_snps)
+            counts += np.histogram(r, edges)[0]
+
+            chosen = slice(None) if sample is None else sample[(sample >= k[0]) & (sample <= k[-1])] - k[0]
+            for values, block_values in zip(points, (x, y, x_std, y_std, r, i - 3, j - 3)):
+                values.append(block_values[chosen])
+
+        return (counts, edges), [np.concatenate(values) for values in points]
+
+    # Computation of alpha post JL, alpha standard, admixture angle post JL, f4-ratio statistics and histogram from sums over the pairs
+    # of auxiliary populations accumulated by blocks of pairs, keeping the f4 points of a uniform sample of the pairs
+    def accumulate_results(self, progress_callback):
+        gram = self.model_gram(self.aux_pops)
         num_aux_pops = len(self.aux_pops)
-        num_pairs = int(num_aux_pops * (num_aux_pops - 1) / 2)
+        num_pairs = num_aux_pops * (num_aux_pops - 1) // 2
 
-        self.f4ab_std = np.zeros(num_pairs)
-        self.f4xb_std = np.zeros(num_pairs)
+        sums, ratio_range = self.accumulate_aux_pairs(gram, num_aux_pops, self.allele_frequencies.num_snps)
+        xy, xx, yy, x, xay, xaxa, xy_std, xx_std, yy_std, x_std, r_sum, r_squares, r_count = sums
+        progress_callback(4)
 
-        ab = self.allele_frequencies[self.parent1_pop] - self.allele_frequencies[self.parent2_pop]
-        xb = self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent2_pop]
+        if event.is_set():
+            return False
 
-        index = 0
+        self.alpha, self.alpha_error = self.sums_least_squares(num_pairs, xy, xx, yy, x)
+        progress_callback(5)
+        self.alpha_std, self.alpha_std_error = self.sums_least_squares(num_pairs, xy_std, xx_std, yy_std, x_std)
+        progress_callback(6)
 
-        for i in range(num_aux_pops):
-            for j in range(i + 1, num_aux_pops):
-                ij = self.allele_frequencies[self.aux_pops[i]] - self.allele_frequencies[self.aux_pops[j]]
-                self.f4ab_std[index] = np.dot(ab, ij)
-                self.f4xb_std[index] = np.dot(xb, ij)
-                index += 1
+        self.cosine_post_jl = xay / np.sqrt(xaxa * yy)
+        self.angle_post_jl = np.arccos(self.cosine_post_jl) * 180 / np.pi
+        self.percentage_post_jl = np.arccos(self.cosine_post_jl) / np.pi
+        progress_callback(7)
 
-        num_alleles = self.allele_frequencies[self.hybrid_pop].size
+        self.num_cases = int(r_count)
+        self.alpha_ratio_avg = r_sum / r_count if r_count > 0 else np.nan
+        self.alpha_ratio_std_dev = np.sqrt(max(r_squares / r_count - self.alpha_ratio_avg ** 2, 0)) * 1.98 if r_count > 0 else np.nan
+        progress_callback(8)
 
-        self.f4ab_std /= num_alleles
-        self.f4xb_std /= num_alleles
+        if event.is_set():
+            return False
 
-    def get_aux_pop_pair(self, index):
-        num_aux_pops = len(self.aux_pops_computed)
-        k = 0
-        for i in range(num_aux_pops):
-            for j in range(i + 1, num_aux_pops):
-                if k == index:
-                    return self.aux_pops_computed[i], self.aux_pops_computed[j]
-                k += 1
-        return '', ''
-
-    # Least squares fit
-    def least_squares(self, x, y):
-        dim = len(x)
+        # Fixed seed, so that the same model and auxiliary populations give the same sample
+        sample = None
+        if self.max_f4_points is not None and num_pairs > self.max_f4_points:
+            sample = np.sort(np.random.default_rng(0).choice(num_pairs, self.max_f4_points, replace = False))
 
-        A = np.vstack([x, np.zeros(dim)]).T
+        self.alpha_ratio_range = ratio_range
+        edges = np.histogram_bin_edges(np.array(ratio_range), self.alpha_ratio_hist_bins)
+        self.alpha_ratio_hist, points = self.accumulate_aux_pair_points(gram, num_aux_pops, edges, sample)
+        self.f4ab_prime, self.f4xb_prime, self.f4ab_std, self.f4xb_std, self.alpha_ratio = points[:5]
+        self.f4_pairs = tuple(points[5:])
+        progress_callback(9)
 
-        alpha = np.linalg.lstsq(A, y)[0][0]
+        return True
 
-        Q = 0
-        for i in range(dim):
-            Q += (y[i] - alpha * x[i]) ** 2
+    # Least squares fit through the origin
+    def least_squares(self, x, y):
+        dim = x.size
 
-        x_avg = 0
-        for i in range(dim):
-            x_avg += x[i]
-        x_avg /= dim
+        alpha = np.sum(x * y) / np.sum(x ** 2)
 
-        x_dev = 0
-        for i in range(dim):
-            x_dev += (x[i] - x_avg) ** 2
+        Q = np.sum((y - alpha * x) ** 2)
+        x_dev = np.sum((x - np.mean(x)) ** 2)
 
         s_alpha = np.sqrt(Q / ((dim - 2) * x_dev))
         t = 1.98
@@ -565,128 +897,187 @@ class Core:
     def alpha_standard(self):
         self.alpha_std, self.alpha_std_error = self.least_squares(self.f4ab_std, self.f4xb_std)
 
-    # Computation of admixture angle post JL
-    def admixture_angle_post_jl(self, aux_pops):
-        num_aux_pops = len(aux_pops)
-
-        xa = self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent1_pop]
-        xb = self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent2_pop]
-
-        sum1 = 0
-        sum2 = 0
-        sum3 = 0
-
-        for i in range(num_aux_pops):
-            for j in range(i + 1, num_aux_pops):
-                ij = self.allele_frequencies[aux_pops[i]] - self.allele_frequencies[aux_pops[j]]
-
-                xaij = np.dot(xa, ij)
-                xbij = np.dot(xb, ij)
-                ijij = np.dot(ij, ij)
-
-                if ijij > 0:
-                    sum1 += xaij * xbij / ijij
-                    sum2 += (xaij ** 2) / ijij
-                    sum3 += (xbij ** 2) / ijij
+    # Computation of admixture angle post JL from f4 prime (X, A) and (X, B) points, pairs of equal auxiliary populations having zero points
+    def admixture_angle_post_jl(self, f4xa_prime, f4xb_prime):
+        sum1 = np.sum(f4xa_prime * f4xb_prime)
+        sum2 = np.sum(f4xa_prime ** 2)
+        sum3 = np.sum(f4xb_prime ** 2)
 
         cosine_post_jl = sum1 / np.sqrt(sum2 * sum3)
         angle_post_jl = np.arccos(cosine_post_jl)
 
         return cosine_post_jl, angle_post_jl
 
-    # Computation of f4-ratio
-    def f4_ratio(self):
-        num_aux_pops = len(self.aux_pops)
-        num_pairs = int(num_aux_pops * (num_aux_pops - 1) / 2)
-
-        xb = self.allele_frequencies[self.hybrid_pop] - self.allele_frequencies[self.parent2_pop]
-        ab = self.allele_frequencies[self.parent1_pop] - self.allele_frequencies[self.parent2_pop]
-
-        self.alpha_ratio = np.zeros(num_pairs)
-
-        index = 0
-
-        for i in range(num_aux_pops):
-            for j in range(i + 1, num_aux_pops):
-                ij = self.allele_frequencies[self.aux_pops[i]] - self.allele_frequencies[self.aux_pops[j]]
-                if not isclose(np.dot(ab, ij), 0, abs_tol=1e-15):
-                    self.alpha_ratio[index] = np.dot(xb, ij) / np.dot(ab, ij)
-                index += 1
-
+    # Weighted block jackknife standard error (Busing et al. 1999) of an estimate, given its estimates leaving out
+    # every block in turn and the numbers of SNPs of those blocks
+    def jackknife_error(self, value, values, sizes):
+        value = np.asarray(value)[..., np.newaxis]
+        h = np.sum(sizes) / sizes
+        mean = sizes.size * value - np.sum((1 - 1 / h) * values, axis = -1, keepdims = True)
+        pseudo_values = h * value - (h - 1) * values
+        return np.sqrt(np.mean((pseudo_values - mean) ** 2 / (h - 1), axis = -1))
+
+    # Statistics of the Gram matrix of several populations and the number of SNPs, with their block jackknife standard errors
+    # Statistics are evaluated at once over the stack of Gram matrices leaving out every block
+    def jackknife(self, statistic, pops):
+        value = statistic(self.allele_frequencies.gram(pops), self.allele_frequencies.num_snps)
+        grams, sizes = self.allele_frequencies.block_grams(pops)
+        if sizes.size < 2:
+            return value, np.full(np.shape(value), np.nan)[()]
+        values = np.array(statistic(grams, self.allele_frequencies.num_snps - sizes))
+        return value, self.jackknife_error(value, values, sizes)
+
+    # Block jackknife standard errors of alpha and admixture angle post JL
+    # Sums over auxiliary pairs are accumulated by blocks of pairs, so that no array grows with the number of blocks times the number of pairs
+    def admixture_jackknife(self):
+        def statistic(gram, num_snps):
+            sums, ratio_range = self.accumulate_aux_pairs(gram, len(self.aux_pops), num_snps)
+            xy, xx, yy, x, xay, xaxa = sums[:6]
+            alpha = xy / xx
+            angle = np.arccos(xay / np.sqrt(xaxa * yy))
+            return alpha, angle * 180 / np.pi
+
+        value, error = self.jackknife(statistic, [self.hybrid_pop, self.parent1_pop, self.parent2_pop] + list(self.aux_pops))
+        self.alpha_jackknife_error, self.angle_post_jl_jackknife_error = error
+
+    # Computation of f4-ratio statistics and histogram from the f4-ratio of every auxiliary pair
+    def f4_ratio_summary(self):
         alpha_01 = self.alpha_ratio[(self.alpha_ratio >= 0) & (self.alpha_ratio <= 1)]
-        self.alpha_ratio_avg = np.average(alpha_01)
-        self.alpha_ratio_std_dev = np.std(alpha_01, dtype='d') * 1.98
+        self.alpha_ratio_avg = np.average(alpha_01) if alpha_01.size > 0 else np.nan
+        self.alpha_ratio_std_dev = np.std(alpha_01, dtype='d') * 1.98 if alpha_01.size > 0 else np.nan
         self.alpha_ratio_hist = np.histogram(self.alpha_ratio, self.alpha_ratio_hist_bins)
         self.num_cases = alpha_01.size
 
-    # Computation of f4-ratio histogram
+    # Computation of f4-ratio histogram, over all auxiliary pairs anew if their f4-ratios were not all kept
     def compute_f4_ratio_histogram(self, bins):
         self.alpha_ratio_hist_bins = bins
-        self.alpha_ratio_hist = np.histogram(self.alpha_ratio, self.alpha_ratio_hist_bins)
+        if self.alpha_ratio_range is None:
+            self.alpha_ratio_hist = np.histogram(self.alpha_ratio, self.alpha_ratio_hist_bins)
+        else:
+            edges = np.histogram_bin_edges(np.array(self.alpha_ratio_range), self.alpha_ratio_hist_bins)
+            self.alpha_ratio_hist, points = self.accumulate_aux_pair_points(self.model_gram(self.aux_pops_computed), len(self.aux_pops_computed), edges, np.zeros(0, dtype = int))
 
-    # Computation of f2
+    # Computation of f2, with its block jackknife standard error
     def compute_f2(self, pops):
-        ab = self.allele_frequencies[pops[0]] - self.allele_frequencies[pops[1]]
-        num_alleles = self.allele_frequencies[pops[0]].size
-        return np.dot(ab, ab) / num_alleles
+        def statistic(gram, num_snps):
+            return difference_product(gram, 0, 1, 0, 1) / num_snps
 
-    # Computation of f3
+        f2, f2_error = self.jackknife(statistic, pops[:2])
+
+        return f2, f2_error
+
+    # Computation of f3, with its block jackknife standard error
     def compute_f3(self, pops):
-        ac = self.allele_frequencies[pops[0]] - self.allele_frequencies[pops[2]]
-        bc = self.allele_frequencies[pops[1]] - self.allele_frequencies[pops[2]]
+        def statistic(gram, num_snps):
+            acbc = difference_product(gram, 0, 2, 1, 2)
+
+            f3 = acbc / num_snps
+            angle = np.arccos(acbc / np.sqrt(difference_product(gram, 0, 2, 0, 2) * difference_product(gram, 1, 2, 1, 2))) * 180 / np.pi
 
-        num_alleles = self.allele_frequencies[pops[0]].size
+            return f3, angle
 
-        f3 = np.dot(ac, bc) / num_alleles
-        angle = np.arccos(np.dot(ac, bc) / np.sqrt(np.dot(ac, ac) * np.dot(bc, bc))) * 180 / np.pi
+        (f3, angle), (f3_error, angle_error) = self.jackknife(statistic, pops[:3])
 
-        return f3, angle
+        return f3, angle, f3_error
 
-    # Computation of f4
+    # Computation of f4, with its block jackknife standard error
     def compute_f4(self, pops):
-        ab = self.allele_frequencies[pops[0]] - self.allele_frequencies[pops[1]]
-        cd = self.allele_frequencies[pops[2]] - self.allele_frequencies[pops[3]]
+        def statistic(gram, num_snps):
+            abcd = difference_product(gram, 0, 1, 2, 3)
+
+            f4 = abcd / num_snps
+            angle = np.arccos(abcd / np.sqrt(difference_product(gram, 0, 1, 0, 1) * difference_product(gram, 2, 3, 2, 3))) * 180 / np.pi
+
+            return f4, angle
+
+        (f4, angle), (f4_error, angle_error) = self.jackknife(statistic, pops[:4])
 
-        num_alleles = self.allele_frequencies[pops[0]].size
+        return f4, angle, f4_error
 
-        f4 = np.dot(ab, cd) / num_alleles
-        angle = np.arccos(np.dot(ab, cd) / np.sqrt(np.dot(ab, ab) * np.dot(cd, cd))) * 180 / np.pi
+    # Matrix of f2 distances among several populations
+    def f2_matrix(self, pops):
+        gram = self.allele_frequencies.gram(pops)
+        diag = np.diag(gram)
+        return (diag[:, np.newaxis] + diag - 2 * gram) / self.allele_frequencies.num_snps
 
-        return f4, angle
+    # Matrix of f3(A, B; C) over several populations A, B and a common population C: outgroup f3 statistics if C is an outgroup,
+    # or admixture f3 statistics if C is a target population
+    def f3_matrix(self, pop, pops):
+        gram = self.allele_frequencies.gram([pop] + list(pops))
+        return (gram[1:, 1:] - gram[1:, :1] - gram[:1, 1:] + gram[0, 0]) / self.allele_frequencies.num_snps
 
     # PCA of allele frequencies
     def compute_pca(self, pops):
-        # frequencies = np.array([(1 - self.allele_frequencies[pop]) * 2 for pop in pops], dtype='d')
-        frequencies = np.array([self.allele_frequencies[pop] for pop in pops], dtype='d')
-        centers = np.mean(frequencies, axis=0, dtype='d')
-        a = np.array([freqs - centers for freqs in frequencies], dtype='d')
-        aat = np.matmul(a, np.transpose(a))
+        # Centered frequencies product, a a^T, from the Gram matrix of the populations centered at their own mean
+        gram = self.allele_frequencies.gram(pops)
+        aat = gram - np.mean(gram, axis = 0) - np.mean(gram, axis = 1)[:, np.newaxis] + np.mean(gram)
         self.pca_eigenvalues, eigenvectors = np.linalg.eigh(aat / (aat.shape[0] - 1))
-        w = np.einsum('ji,jk', a, eigenvectors[:, ::-1])
-        norms = np.linalg.norm(w, axis=0)
-        wn = w / norms
-        self.principal_components = np.einsum('ij,jk', a, wn)
+        # Projections a a^T v of the centered frequencies over normalized principal axes a^T v
+        aatv = aat @ eigenvectors[:, ::-1]
+        norms = np.sqrt(np.maximum(np.einsum('ij,ij->j', eigenvectors[:, ::-1], aatv), 0))
+        self.principal_components = np.divide(aatv, norms, out = np.zeros_like(aatv), where = norms > 0)
         self.explained_variance = 100 * np.flip(self.pca_eigenvalues)[:3]/np.sum(self.pca_eigenvalues)
         self.pca_pops = pops
 
     def check_singularities(self):
-        aux_pops_close = []
-        num_aux_pops = len(self.aux_pops)
-        for i in range(num_aux_pops):
-            for j in range(i + 1, num_aux_pops):
-                aux_pops_close.append(np.allclose(self.allele_frequencies[self.aux_pops[i]], self.allele_frequencies[self.aux_pops[j]], rtol = 0, atol = 1e-15))
+        gram = self.model_gram(self.aux_pops)
+        i, j = self.aux_pairs(len(self.aux_pops))
+
+        # Populations are equal if the norm of their difference vanishes
+        tolerance = gram_zero(gram)
+        equal = lambda p, q: difference_product(gram, p, q, p, q) <= tolerance
 
         singularities = {
-            f'{self.parent1_pop} ~ {self.parent2_pop}': np.allclose(self.allele_frequencies[self.parent1_pop], self.allele_frequencies[self.parent2_pop], rtol = 0, atol = 1e-15),
-            f'{self.hybrid_pop} ~ {self.parent1_pop}': np.allclose(self.allele_frequencies[self.hybrid_pop], self.allele_frequencies[self.parent1_pop], rtol = 0, atol = 1e-15),
-            f'{self.hybrid_pop} ~ {self.parent2_pop}': np.allclose(self.allele_frequencies[self.hybrid_pop], self.allele_frequencies[self.parent2_pop], rtol = 0, atol = 1e-15),
-            'Equal auxiliary populations': all(aux_pops_close)
+            f'{self.parent1_pop} ~ {self.parent2_pop}': equal(1, 2),
+            f'{self.hybrid_pop} ~ {self.parent1_pop}': equal(0, 1),
+            f'{self.hybrid_pop} ~ {self.parent2_pop}': equal(0, 2),
+            'Equal auxiliary populations': bool(np.all(equal(i, j)))
         }
 
         return singularities
 
+    # Pairs of identical auxiliary populations, with equal content hashes of their allele counts or a squared distance of their frequency vectors,
+    # derived from their norms and products in their Gram matrix, under the tolerance of products taken as zero, or near-identical,
+    # with an f2 distance under a fraction of the median f2 distance of all auxiliary pairs, as rows (pop 1, pop 2, f2 distance)
+    def duplicate_aux_pairs(self, aux_pops = None):
+        if aux_pops is None:
+            aux_pops = self.aux_pops
+        if len(aux_pops) < 2:
+            return []
+
+        hashes = np.array([self.allele_frequencies.content_hash(pop) for pop in aux_pops])
+
+        gram = self.allele_frequencies.gram(aux_pops)
+        norms = np.diag(gram)
+        distances = norms[:, np.newaxis] + norms - 2 * gram
+        f2 = np.maximum(distances, 0) / self.allele_frequencies.num_snps
+
+        identical = (hashes[:, np.newaxis] == hashes) | (distances <= gram_zero(gram))
+        near = f2 <= self.near_duplicate_f2 * np.median(f2[np.triu_indices(len(aux_pops), 1)])
+        i, j = np.nonzero(np.triu(identical | near, 1))
+
+        return [(aux_pops[p], aux_pops[q], f2[p, q]) for p, q in zip(i, j)]
+
+    # Set fraction of the median f2 distance of auxiliary pairs under which auxiliary populations are taken as near-identical
+    def set_near_duplicate_f2(self, fraction):
+        self.near_duplicate_f2 = fraction
+
+    # Exclude auxiliary populations identical or near-identical to a preceding one, returning those excluded
+    def exclude_duplicate_aux_pops(self):
+        excluded = list(dict.fromkeys(pop2 for pop1, pop2, f2 in self.duplicate_aux_pairs()))
+        self.aux_pops = [pop for pop in self.aux_pops if pop not in excluded]
+        return excluded
+
     # Compute all results
     def compute_results(self, progress_callback):
+        event.clear()
+        return self.evaluate_results(progress_callback)
+
+    # Compute all results, stopping if the cancellation token was set, also before starting
+    def evaluate_results(self, progress_callback):
+        if event.is_set():
+            return False
+
         progress_callback(0)
 
         self.mixing_coefficient_pre_jl()
@@ -698,79 +1089,516 @@ class Core:
         self.f3()
         progress_callback(3)
 
-        self.f4ab_prime, self.f4xb_prime = self.f4_prime(self.aux_pops)
+        if event.is_set():
+            return False
+
+        if self.stream_aux_pairs(len(self.aux_pops)):
+            if not self.accumulate_results(progress_callback):
+                return False
+        elif not self.compute_pairs_results(progress_callback):
+            return False
+
+        if event.is_set():
+            return False
+
+        self.admixture_jackknife()
+        progress_callback(10)
+
+        self.aux_pops_computed = self.aux_pops
+        self.update_snp_counts()
+
+        return True
+
+    # Computation of alpha post JL, alpha standard, admixture angle post JL and f4-ratio statistics and histogram over arrays of all auxiliary pairs
+    def compute_pairs_results(self, progress_callback):
+        f4xa_prime = self.aux_points()
         progress_callback(4)
 
+        if event.is_set():
+            return False
+
         try:
             self.alpha_prime()
         except np.linalg.LinAlgError:
             raise np.linalg.LinAlgError
         progress_callback(5)
 
-        self.f4_std()
-        progress_callback(6)
-
         try:
             self.alpha_standard()
         except np.linalg.LinAlgError:
             raise np.linalg.LinAlgError
         progress_callback(7)
 
-        self.cosine_post_jl, self.angle_post_jl = self.admixture_angle_post_jl(self.aux_pops)
+        if event.is_set():
+            return False
+
+        self.cosine_post_jl, self.angle_post_jl = self.admixture_angle_post_jl(f4xa_prime, self.f4xb_prime)
         self.angle_post_jl *= 180 / np.pi
         self.percentage_post_jl = np.arccos(self.cosine_post_jl) / np.pi
         progress_callback(8)
 
-        self.f4_ratio()
+        if event.is_set():
+            return False
+
+        self.f4_ratio_summary()
         progress_callback(9)
 
+        return True
+
+    # Contributions of every pair of candidate auxiliary populations of the current model, all selected populations but the model ones:
+    # f4 prime, standard f4 and f4-ratio points, and matrices of the terms of the sums behind alpha, its error and the admixture angle post JL
+    def init_aux_contributions(self):
+        model = (self.hybrid_pop, self.parent1_pop, self.parent2_pop)
+        candidates = [pop for pop in self.selected_pops if pop not in model]
+
+        gram = self.model_gram(candidates)
+        i, j = self.aux_pairs(len(candidates))
+
+        x, y, xa, x_std, y_std, r = self.aux_pair_points(gram, i, j, self.allele_frequencies.num_snps)
+        points = {'f4ab_prime': x, 'f4xb_prime': y, 'f4ab_std': x_std, 'f4xb_std': y_std, 'alpha_ratio': r}
+
+        # Least squares sums of f4 prime and standard f4 points, sums of products of f4 prime points for the angle,
+        # and sums of f4-ratios within [0, 1] and their number
+        r_01 = (r >= 0) & (r <= 1)
+        pair_terms = [x * y, x * x, y * y, x, xa * y, xa * xa, x_std * y_std, x_std * x_std, y_std * y_std, x_std, np.where(r_01, r, 0), r_01]
+
+        terms = np.zeros((len(pair_terms), len(candidates), len(candidates)))
+        terms[:, i - 3, j - 3] = pair_terms
+        terms += np.swapaxes(terms, 1, 2)
+
+        self.aux_contributions = {
+            'model': model,
+            'candidates': candidates,
+            'index': {pop: index for index, pop in enumerate(candidates)},
+            'pairs': (i - 3, j - 3),
+            'points': points,
+            'terms': terms,
+            'members': np.zeros(len(candidates)),
+            'sums': np.zeros(len(pair_terms))
+        }
+
+    # Bring the sums over the pairs of auxiliary populations in use up to date, adding or subtracting the contributions of the pairs
+    # of every toggled population with the auxiliary populations in use, instead of recomputing sums over all pairs
+    def sync_aux_contributions(self, aux_pops):
+        contributions = self.aux_contributions
+        if contributions is None or contributions['model'] != (self.hybrid_pop, self.parent1_pop, self.parent2_pop) or any(pop not in contributions['index'] for pop in aux_pops):
+            self.init_aux_contributions()
+            contributions = self.aux_contributions
+
+            # Model statistics do not depend on auxiliary populations
+            self.mixing_coefficient_pre_jl()
+            self.admixture_angle_pre_jl()
+            self.f3()
+
+        terms = contributions['terms']
+        members = contributions['members']
+        sums = contributions['sums']
+
+        selected = np.zeros(members.size)
+        selected[[contributions['index'][pop] for pop in aux_pops]] = 1
+
+        for k in np.flatnonzero(selected > members):
+            sums += terms[:, k] @ members
+            members[k] = 1
+        for k in np.flatnonzero(selected < members):
+            members[k] = 0
+            sums -= terms[:, k] @ members
+
+        return contributions
+
+    # Whether the contributions of the pairs of all candidate auxiliary populations of the current model are few enough to be kept,
+    # as (terms x candidates x candidates) matrices, for incremental updates of results
+    def incremental_aux_updates(self):
+        model = (self.hybrid_pop, self.parent1_pop, self.parent2_pop)
+        return not self.stream_aux_pairs(len([pop for pop in self.selected_pops if pop not in model]))
+
+    # Update results as auxiliary populations are added or removed, from the sums over the pairs of auxiliary populations in use
+    # Block jackknife and bootstrap errors are left undefined until results are fully computed
+    # Not updated if there are too many pairs of candidate auxiliary populations to keep their contributions
+    def update_aux_pops(self, aux_pops):
+        if not self.incremental_aux_updates():
+            return False
+
+        contributions = self.sync_aux_contributions(aux_pops)
+        members = contributions['members']
+        sums = contributions['sums']
+
+        # Auxiliary populations in the order of candidates, so that their pairs are those in use in the same order
+        self.aux_pops = [pop for pop, member in zip(contributions['candidates'], members) if member > 0]
         self.aux_pops_computed = self.aux_pops
 
+        i, j = contributions['pairs']
+        in_use = (members[i] > 0) & (members[j] > 0)
+        points = {name: values[in_use] for name, values in contributions['points'].items()}
+        self.f4ab_prime, self.f4xb_prime = points['f4ab_prime'], points['f4xb_prime']
+        self.f4ab_std, self.f4xb_std = points['f4ab_std'], points['f4xb_std']
+        self.alpha_ratio = points['alpha_ratio']
+        self.alpha_ratio_range = None
+        self.f4_ratio_summary()
+
+        positions = np.cumsum(members, dtype = int) - 1
+        self.f4_pairs = (positions[i[in_use]], positions[j[in_use]])
+
+        xy, xx, yy, x, xay, xaxa, xy_std, xx_std, yy_std, x_std = sums[:10]
+        num_pairs = self.f4ab_prime.size
+
+        self.alpha, self.alpha_error = self.sums_least_squares(num_pairs, xy, xx, yy, x)
+        self.alpha_std, self.alpha_std_error = self.sums_least_squares(num_pairs, xy_std, xx_std, yy_std, x_std)
+
+        self.cosine_post_jl = xay / np.sqrt(xaxa * yy)
+        self.angle_post_jl = np.arccos(self.cosine_post_jl) * 180 / np.pi
+        self.percentage_post_jl = np.arccos(self.cosine_post_jl) / np.pi
+
+        self.alpha_jackknife_error = np.nan
+        self.angle_post_jl_jackknife_error = np.nan
+        self.std_dev_alpha = np.nan
+        self.std_dev_angle = np.nan
+
+        self.update_snp_counts()
+
         return True
 
+    # Least squares fit through the origin from the sums of the products of the points, as computed by least_squares
+    def sums_least_squares(self, dim, xy, xx, yy, x):
+        alpha = xy / xx
+
+        Q = yy - 2 * alpha * xy + alpha ** 2 * xx
+        x_dev = xx - x ** 2 / dim
+
+        s_alpha = np.sqrt(np.maximum(Q, 0) / ((dim - 2) * x_dev))
+        t = 1.98
+
+        error = s_alpha * t
+
+        return alpha, error
+
+    # Alpha post JL, admixture angle post JL and f4-ratio average leaving out every auxiliary population in turn,
+    # subtracting the contributions of its pairs from the sums over the pairs of all auxiliary populations
+    # Not computed if there are too many pairs of candidate auxiliary populations to keep their contributions
+    def compute_aux_influence(self):
+        if not self.incremental_aux_updates():
+            self.aux_influence = []
+            return False
+
+        contributions = self.sync_aux_contributions(self.aux_pops)
+        members = contributions['members']
+        in_use = np.flatnonzero(members > 0)
+
+        xy, xx, yy, x, xay, xaxa, xy_std, xx_std, yy_std, x_std, r_sum, r_count = contributions['sums'][:, np.newaxis] - contributions['terms'][:, in_use] @ members
+
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            alpha = xy / xx
+            angle = np.arccos(xay / np.sqrt(xaxa * yy)) * 180 / np.pi
+            ratio_avg = r_sum / r_count
+
+        self.aux_influence = [(contributions['candidates'][k], alpha[n], angle[n], ratio_avg[n]) for n, k in enumerate(in_use)]
+
+        return True
+
+    # Get auxiliary populations influence in text form, most influential on alpha first
+    def aux_influence_data(self):
+        rows = sorted(self.aux_influence, key = lambda row: -abs(row[1] - self.alpha))
+
+        pops_width = max([len(row[0]) for row in rows] + [len('Removed')])
+        col_width = 13
+
+        text = '{0:^{pops_width}} {1:^{col_width}} {2:^{col_width}} {3:^{col_width}} {4:^{col_width}} {5:^{col_width}}'.format('Removed', 'Alpha', 'AlphaChange', 'Angle', 'AngleChange', 'f4RatioAvg', pops_width = pops_width, col_width = col_width)
+        for pop, alpha, angle, ratio_avg in rows:
+            text += '\n{0:{pops_width}} {1: {col_width}.4f} {2: {col_width}.4f} {3: {col_width}.2f} {4: {col_width}.2f} {5: {col_width}.4f}'.format(pop, alpha, alpha - self.alpha, angle, angle - self.angle_post_jl, ratio_avg, pops_width = pops_width, col_width = col_width)
+
+        return text
+
+    # Save auxiliary populations influence
+    def save_aux_influence(self, file_path):
+        with file_path.open(mode = 'w', encoding = 'utf-8') as file:
+            file.write(self.aux_influence_data() + '\n')
+
     def get_bootstrap_conditions(self, aux_pops = None):
         if aux_pops is None:
             aux_pops = self.aux_pops
 
-        num_aux_pops = len(aux_pops)
+        num_bootstrap_pops = int(len(aux_pops) / 2)
+        num_tasks = ceil(self.bootstrap_replicates / self.bootstrap_task_size)
+
+        return num_bootstrap_pops, self.bootstrap_replicates, num_tasks
+
+    def set_bootstrap_replicates(self, num_replicates):
+        self.bootstrap_replicates = max(1, int(num_replicates))
+
+    def set_bootstrap_seed(self, seed):
+        self.bootstrap_seed = seed
 
-        num_its = int(num_aux_pops * (num_aux_pops * 0.5 - 1) * 0.25)
-        # num_its_ja = int(np.ceil(num_aux_pops / 2) * (np.ceil(num_aux_pops / 2) - 1) / 2)
-        if num_its > 50: num_its = 50
+    # Sums over pairs of auxiliary populations from which every bootstrap replicate is evaluated, as symmetric matrices:
+    # products of f4 prime points for alpha and for the admixture angle post JL
+    def bootstrap_terms(self, aux_pops):
+        i, j = self.aux_pairs(len(aux_pops))
+        x, y, xa, x_std, y_std, r = self.aux_pair_points(self.model_gram(aux_pops), i, j, self.allele_frequencies.num_snps)
 
-        num_bootstrap_pops = int(num_aux_pops / 2)
+        terms = np.zeros((5, len(aux_pops), len(aux_pops)))
+        terms[:, i - 3, j - 3] = [x * y, x * x, xa * y, xa * xa, y * y]
+        terms += np.swapaxes(terms, 1, 2)
 
-        return num_bootstrap_pops, num_its
+        return terms
 
+    # Bootstrap over subsets of half the auxiliary populations, drawn without replacement
+    # Every task of replicates gets its own random stream spawned from the seed, so results depend on the seed only,
+    # not on the number of processes evaluating them
     def compute_bootstrap(self, progress_callback):
+        event.clear()
+        return self.evaluate_bootstrap(progress_callback)
+
+    # Bootstrap, stopping if the cancellation token was set, also before starting
+    def evaluate_bootstrap(self, progress_callback):
+        if event.is_set():
+            return False
+
         progress_callback(0)
 
-        num_bootstrap_pops, num_its = self.get_bootstrap_conditions(self.aux_pops_computed)
+        num_bootstrap_pops, num_replicates, num_tasks = self.get_bootstrap_conditions(self.aux_pops_computed)
+
+        seed_sequence = np.random.SeedSequence(self.bootstrap_seed)
+        self.bootstrap_entropy = seed_sequence.entropy
+
+        terms = self.bootstrap_terms(self.aux_pops_computed)
+        sizes = [min(self.bootstrap_task_size, num_replicates - start) for start in range(0, num_replicates, self.bootstrap_task_size)]
+        tasks = [(terms, num_bootstrap_pops, size, seed) for size, seed in zip(sizes, seed_sequence.spawn(num_tasks))]
+
+        # Worker processes are only worth it for several tasks
+        results = self.worker_pool().imap(bootstrap_task, tasks) if num_tasks > 1 else map(bootstrap_task, tasks)
+
+        alphas = []
+        angles = []
+
+        for index, (alpha, angle) in enumerate(results):
+            if event.is_set():
+                continue
+
+            alphas.append(alpha)
+            angles.append(angle)
+
+            progress_callback(index + 1)
 
-        std_dev_alpha = 0
-        std_dev_angle = 0
+        if event.is_set():
+            return False
+
+        alphas = np.concatenate(alphas)
+        angles = np.concatenate(angles)
+
+        self.std_dev_alpha = 1.98 * np.sqrt(np.mean((alphas - self.alpha) ** 2))
+        self.std_dev_angle = 1.98 * np.sqrt(np.mean((angles - self.angle_post_jl) ** 2))
+
+        return True
+
+    # Evaluate all admixture models from the frequencies of the selected populations, computed once for all of them,
+    # saving the f4 points of every model into a directory if given
+    # The cancellation token is only cleared once, so that a stop between two models ends the batch
+    def compute_models(self, progress_callback, f4_points_path = None):
+        event.clear()
+
+        self.models_results = []
 
-        for it in range(num_its):
-            bootstrap_pops = np.random.choice(self.aux_pops, num_bootstrap_pops, replace=False)
+        for index, (hybrid, parent1, parent2, aux_pops) in enumerate(self.models):
+            self.hybrid_pop = hybrid
+            self.parent1_pop = parent1
+            self.parent2_pop = parent2
+            self.aux_pops = self.model_aux_pops(index)
 
-            f4ab_prime, f4xb_prime = self.f4_prime(bootstrap_pops)
-            try:
-                alpha, alpha_error = self.least_squares(f4ab_prime, f4xb_prime)
-            except np.linalg.LinAlgError:
-                raise np.linalg.LinAlgError
-            std_dev_alpha += (alpha - self.alpha) ** 2
+            if not self.evaluate_results(lambda step: None):
+                return False
+            if self.bootstrap and not self.evaluate_bootstrap(lambda step: None):
+                return False
 
-            cosine, angle = self.admixture_angle_post_jl(bootstrap_pops)
-            angle *= 180 / np.pi
-            std_dev_angle += (angle - self.angle_post_jl) ** 2
+            self.models_results.append((hybrid, parent1, parent2, len(self.aux_pops), self.alpha, self.alpha_error, self.alpha_jackknife_error, self.angle_post_jl, self.angle_post_jl_jackknife_error, self.alpha_ratio_avg, self.f3_test, self.std_dev_alpha, self.std_dev_angle))
 
-            progress_callback(it + 1)
+            if f4_points_path is not None:
+                self.save_f4_points(f4_points_path.joinpath(Path(f'f4_{index + 1}_{hybrid}_{parent1}_{parent2}.dat')))
 
-        std_dev_alpha = np.sqrt(std_dev_alpha / num_its)
-        std_dev_angle = np.sqrt(std_dev_angle / num_its)
+            progress_callback(index + 1)
 
-        self.std_dev_alpha = 1.98 * std_dev_alpha
-        self.std_dev_angle = 1.98 * std_dev_angle
+        return True
+
+    # Get results of all admixture models in text form, with bootstrap errors if computed
+    def models_data(self):
+        headers = ['Model', 'Hybrid', 'Parent1', 'Parent2', 'NumAux', 'Alpha', 'AlphaFitErr', 'AlphaJkSE', 'Angle', 'AngleJkSE', 'f4RatioAvg', 'f3']
+        if self.bootstrap:
+            headers += ['AlphaBootErr', 'AngleBootErr']
+
+        pops_width = max([len(pop) for row in self.models_results for pop in row[:3]] + [len('Parent1')])
+        prec = 6
+        col_width = prec + 7
+
+        text = ' '.join('{0:^{width}}'.format(header, width = pops_width if 0 < index < 4 else col_width) for index, header in enumerate(headers))
+        for index, row in enumerate(self.models_results):
+            values = row[4:] if self.bootstrap else row[4:-2]
+            text += '\n{0:^{col_width}} {1:{pops_width}} {2:{pops_width}} {3:{pops_width}} {4:^{col_width}} '.format(index + 1, *row[:4], pops_width = pops_width, col_width = col_width)
+            text += ' '.join('{0: {col_width}.{prec}E}'.format(value, col_width = col_width, prec = prec) for value in values)
+
+        return text
+
+    # Save results of all admixture models
+    def save_models_results(self, file_path):
+        with file_path.open(mode = 'w', encoding = 'utf-8') as file:
+            file.write(self.models_data() + '\n')
+
+    # Scan f4(A, B; C, D) statistics over all quadruples of distinct populations, keeping those of greatest absolute value,
+    # or of greatest absolute cosine of their angle, with their block jackknife standard errors
+    # Pairs (A, B) are drawn from left populations and pairs (C, D) from right ones, all selected populations if not given
+    def scan_f4(self, progress_callback, left_pops = None, right_pops = None, angle = False, num_top = 100):
+        event.clear()
+
+        left_pops = list(self.selected_pops if left_pops is None else left_pops)
+        right_pops = list(self.selected_pops if right_pops is None else right_pops)
+        same_pairs = left_pops == right_pops
+
+        # Quadruples need at least two populations on each side
+        self.f4_scan_results = []
+        self.num_f4_scan_tasks = 0
+        if len(left_pops) < 2 or len(right_pops) < 2:
+            return True
+
+        all_pops = list(dict.fromkeys(left_pops + right_pops))
+        indices = {pop: index for index, pop in enumerate(all_pops)}
+
+        gram = self.allele_frequencies.gram(all_pops)
+
+        left = tuple(np.array([indices[left_pops[k]] for k in ks], dtype = int) for ks in np.triu_indices(len(left_pops), 1))
+        right = tuple(np.array([indices[right_pops[k]] for k in ks], dtype = int) for ks in np.triu_indices(len(right_pops), 1))
+
+        # Left pairs are split into ranges of equal numbers of quadruples, fewer per range towards the end if pairs of pairs are not repeated
+        num_tasks = 4 * self.num_procs
+        if same_pairs:
+            remaining = np.cumsum((right[0].size - np.arange(left[0].size))[::-1])[::-1]
+            bounds = np.searchsorted(-remaining, -np.linspace(remaining[0] if remaining.size > 0 else 0, 0, num_tasks + 1))
+        else:
+            bounds = np.linspace(0, left[0].size, num_tasks + 1).astype(int)
+        bounds[-1] = left[0].size
+
+        tasks = [(gram, left, right, start, stop, same_pairs, angle, num_top) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+        self.num_f4_scan_tasks = len(tasks)
+
+        # Worker processes are only worth it for several tasks
+        results = self.worker_pool().imap_unordered(f4_scan_task, tasks) if self.num_procs > 1 else map(f4_scan_task, tasks)
+
+        best = (np.zeros(0), np.zeros(0), np.zeros(0, dtype = int), np.zeros(0, dtype = int))
+
+        for index, result in enumerate(results):
+            if event.is_set():
+                continue
+
+            best = top_entries(num_top, *[np.concatenate(pair) for pair in zip(best, result)])
+
+            progress_callback(index + 1)
+
+        if event.is_set():
+            return False
+
+        for row, col in zip(best[2], best[3]):
+            pops = [all_pops[left[0][row]], all_pops[left[1][row]], all_pops[right[0][col]], all_pops[right[1][col]]]
+            f4, f4_angle, f4_error = self.compute_f4(pops)
+            self.f4_scan_results.append((*pops, f4, f4_angle, f4_error))
+
+        return True
+
+    # Get quadruples of greatest f4 statistics in text form
+    def f4_scan_data(self):
+        pops_width = max([len(pop) for row in self.f4_scan_results for pop in row[:4]] + [1])
+        prec = 6
+        col_width = prec + 7
+
+        text = '{0:^{pops_width}} {1:^{pops_width}} {2:^{pops_width}} {3:^{pops_width}} {4:^{col_width}} {5:^{col_width}} {6:^{col_width}} {7:^{col_width}}'.format('A', 'B', 'C', 'D', 'f4', 'Angle', 'SE', 'Z', pops_width = pops_width, col_width = col_width)
+        for row in self.f4_scan_results:
+            text += '\n{0:{pops_width}} {1:{pops_width}} {2:{pops_width}} {3:{pops_width}} {4: {col_width}.{prec}E} {5: {col_width}.2f} {6: {col_width}.{prec}E} {7: {col_width}.2f}'.format(*row, row[4] / row[6], pops_width = pops_width, col_width = col_width, prec = prec)
+
+        return text
+
+    # Save quadruples of greatest f4 statistics
+    def save_f4_scan_results(self, file_path):
+        with file_path.open(mode = 'w', encoding = 'utf-8') as file:
+            file.write(self.f4_scan_data() + '\n')
+
+    # Scan admixture models made of every hybrid population, or given ones, and every pair of parent populations among several populations,
+    # with auxiliary populations given or else all remaining ones. Swapping parents only turns alpha into 1 - alpha, so parents are unordered
+    # All models share the Gram matrix of all populations, from which sums over auxiliary pairs are looked up
+    def scan_admixture_models(self, progress_callback, pops = None, hybrid_pops = None, aux_pops = None):
+        event.clear()
+
+        pops = list(self.selected_pops if pops is None else pops)
+        hybrid_pops = pops if hybrid_pops is None else list(hybrid_pops)
+        aux_pops = pops if aux_pops is None else list(aux_pops)
+
+        all_pops = list(dict.fromkeys(pops + aux_pops))
+        indices = {pop: index for index, pop in enumerate(all_pops)}
+
+        gram = self.allele_frequencies.gram(all_pops)
+
+        # Inverse squared norms of the differences of auxiliary populations, zero for other pairs and equal populations
+        diag = np.diag(gram)
+        norms = diag[:, np.newaxis] + diag - 2 * gram
+        aux = np.isin(all_pops, aux_pops)
+        nonzero = (norms > gram_zero(gram)) & aux[:, np.newaxis] & aux
+        weights = np.divide(1, norms, out = np.zeros_like(norms), where = nonzero)
+
+        parents1, parents2 = np.triu_indices(len(pops), 1)
+        hybrids = np.repeat([indices[pop] for pop in hybrid_pops], parents1.size)
+        parents1 = np.tile(parents1, len(hybrid_pops))
+        parents2 = np.tile(parents2, len(hybrid_pops))
+        # Models need at least 4 auxiliary populations besides their own ones
+        num_aux = len(set(aux_pops)) - aux[hybrids].astype(int) - aux[parents1] - aux[parents2]
+        models = (hybrids != parents1) & (hybrids != parents2) & (num_aux >= 4)
+        hybrids, parents1, parents2 = hybrids[models], parents1[models], parents2[models]
+
+        num_snps = self.allele_frequencies.num_snps
+        tasks = [(gram, weights, num_snps, hybrids[chunk], parents1[chunk], parents2[chunk]) for chunk in np.array_split(np.arange(hybrids.size), self.num_procs)]
+
+        # Worker processes are only worth it for several tasks
+        results = self.worker_pool().imap(admixture_scan_task, tasks) if len(tasks) > 1 else map(admixture_scan_task, tasks)
+
+        alpha = []
+        angle = []
+        f3 = []
+
+        for index, result in enumerate(results):
+            if event.is_set():
+                continue
+
+            alpha.append(result[0])
+            angle.append(result[1])
+            f3.append(result[2])
+
+            progress_callback(index + 1)
+
+        if event.is_set():
+            return False
+
+        alpha = np.concatenate(alpha)
+        angle = np.concatenate(angle)
+        f3 = np.concatenate(f3)
+
+        # Models with alpha in [0, 1] first, then angles closest to 180 deg, then most negative f3
+        infeasible = ~((alpha >= 0) & (alpha <= 1))
+        order = np.lexsort((f3, -angle, infeasible))
+        self.scan_results = [(all_pops[hybrids[k]], all_pops[parents1[k]], all_pops[parents2[k]], angle[k], alpha[k], f3[k]) for k in order]
+
+        return True
+
+    # Get scanned admixture models in text form, the best ones if a number is given
+    def scan_data(self, num_models = None):
+        rows = self.scan_results if num_models is None else self.scan_results[:num_models]
+
+        pops_width = max([len(pop) for row in rows for pop in row[:3]] + [len('Parent1')])
+        prec = 6
+        col_width = prec + 7
+
+        text = '{0:^{pops_width}} {1:^{pops_width}} {2:^{pops_width}} {3:^{col_width}} {4:^{col_width}} {5:^{col_width}}'.format('Hybrid', 'Parent1', 'Parent2', 'Angle', 'Alpha', 'f3', pops_width = pops_width, col_width = col_width)
+        for row in rows:
+            text += '\n{0:{pops_width}} {1:{pops_width}} {2:{pops_width}} {3: {col_width}.2f} {4: {col_width}.{prec}f} {5: {col_width}.{prec}E}'.format(*row, pops_width = pops_width, col_width = col_width, prec = prec)
+
+        return text
+
+    # Save scanned admixture models
+    def save_scan_results(self, file_path):
+        with file_path.open(mode = 'w', encoding = 'utf-8') as file:
+            file.write(self.scan_data() + '\n')
 
     # Plot a fit
     def plot_fit(self, x, y, alpha, title, xlabel, ylabel):
@@ -827,35 +1655,40 @@ class Core:
         alpha_bootstrap_error = f' +/- {self.std_dev_alpha:6.4f} (bootstrap, 95% CI)' if self.bootstrap else ''
 
         text = f'Admixture model: {self.hybrid_pop} = {self.parent1_pop} + {self.parent2_pop}\n'
-        text += f'SNPs used: {self.num_valid_alleles} / {self.num_alleles}\n'
+        monomorphic = f' ({self.num_uninformative_alleles} monomorphic, skipped)' if self.num_uninformative_alleles > 0 else ''
+        text += f'SNPs used: {self.num_valid_alleles} / {self.num_alleles}{monomorphic}\n'
         text += f'Auxiliary populations: {num_aux_pops}\n'
         text += f'Auxiliary pairs: {num_aux_pairs}\n'
         text += f'Cos pre-JL:  {self.cosine_pre_jl:7.4f} ---> Angle pre-JL:  {self.angle_pre_jl:7.2f} deg vs 180 deg: {self.percentage_pre_jl:.1%}\n'
         text += f'Cos post-JL: {self.cosine_post_jl:7.4f} ---> Angle post-JL: {self.angle_post_jl:7.2f} {angle_bootstrap_error} vs 180 deg: {self.percentage_post_jl:.1%}\n'
         text += f'Alpha post-JL: {self.alpha:6.4f} +/- {self.alpha_error:6.4f} (fit, 95% CI){alpha_bootstrap_error}\n'
+        text += f'Block jackknife standard errors: alpha post-JL {self.alpha_jackknife_error:6.4f}, angle post-JL {self.angle_post_jl_jackknife_error:5.2f} deg\n'
         text += '---\nAdditional indices:\n'
         text += f'Alpha pre-JL: {self.alpha_pre_jl:6.4f}\n'
         text += f'Alpha (Non-Renormalized) post-JL: {self.alpha_std:6.4f} +/- {self.alpha_std_error:6.4f} (fit, 95% CI)\n'
         text += f'f4-ratio average if in [0, 1]: {self.alpha_ratio_avg:6.4f} +/- {self.alpha_ratio_std_dev:6.4f} (95% CI), {self.num_cases} cases\n'
         text += f'Standard admixture test: f3(source1, source2; admix) < 0 ? {self.f3_test:8.6f}'
+        if self.f4_pairs[0].size < num_aux_pairs:
+            text += f'\nf4 points: sample of {self.f4_pairs[0].size} auxiliary pairs'
+        if self.bootstrap:
+            text += f'\nBootstrap: {self.bootstrap_replicates} replicates of {int(num_aux_pops / 2)} auxiliary populations, seed {self.bootstrap_entropy}'
 
         return text
 
     # Save frequencies
     def save_population_allele_frequencies(self, file_path):
         with file_path.open(mode='w', encoding='utf-8') as file:
-            pops_width = max([len(name) for name in self.selected_pops])
+            pops_width = max([len(name) for name in self.allele_frequencies.pops])
             prec = 6
             col_width = max(prec + 7, pops_width)
 
-            headers_format = ' '.join([f'{{{i}:^{col_width}}}' for i, pop in enumerate(self.selected_pops)])
-            headers = headers_format.format(*self.selected_pops)
+            headers_format = ' '.join([f'{{{i}:^{col_width}}}' for i, pop in enumerate(self.allele_frequencies.pops)])
+            headers = headers_format.format(*self.allele_frequencies.pops)
             file.write(headers + '\n')
 
-            row_format = ' '.join([f'{{{i}: {col_width}.{prec}E}}' for i, pop in enumerate(self.selected_pops)])
+            row_format = ' '.join([f'{{{i}: {col_width}.{prec}E}}' for i, pop in enumerate(self.allele_frequencies.pops)])
 
-            for allele_index in range(self.num_valid_alleles):
-                row = [freqs[allele_index] for pop, freqs in self.allele_frequencies.items()]
+            for row in self.allele_frequencies.rows(self.allele_frequencies.pops).T:
                 file.write(row_format.format(*row) + '\n')
 
     # Save f4 points
@@ -868,15 +1701,10 @@ class Core:
             headers = '{0:^{col_width}} {1:^{col_width}} {2:^{col_width}} {3:^{col_width}} {4:^{col_width}} {5:^{aux_pops_width}} {6:^{aux_pops_width}}'.format('f4primeAB', 'f4primeXB', 'f4AB', 'f4XB', 'f4-ratio', 'Aux1', 'Aux2', col_width = col_width, aux_pops_width = aux_pops_width)
             file.write(headers + '\n')
 
-            num_aux_pops = len(self.aux_pops_computed)
-
-            index = 0
-
-            for i in range(num_aux_pops):
-                for j in range(i + 1, num_aux_pops):
-                    row = '{0: {col_width}.{prec}E} {1: {col_width}.{prec}E} {2: {col_width}.{prec}E} {3: {col_width}.{prec}E} {4: {col_width}.{prec}E} {5:{aux_pops_width}} {6:{aux_pops_width}}'.format(self.f4ab_prime[index], self.f4xb_prime[index], self.f4ab_std[index], self.f4xb_std[index], self.alpha_ratio[index], self.aux_pops[i], self.aux_pops[j], prec = prec, col_width = col_width, aux_pops_width = aux_pops_width)
-                    file.write(row + '\n')
-                    index += 1
+            # Points of all auxiliary pairs, or of a sample of them
+            for index, (i, j) in enumerate(zip(*self.f4_pairs)):
+                row = '{0: {col_width}.{prec}E} {1: {col_width}.{prec}E} {2: {col_width}.{prec}E} {3: {col_width}.{prec}E} {4: {col_width}.{prec}E} {5:{aux_pops_width}} {6:{aux_pops_width}}'.format(self.f4ab_prime[index], self.f4xb_prime[index], self.f4ab_std[index], self.f4xb_std[index], self.alpha_ratio[index], self.aux_pops_computed[i], self.aux_pops_computed[j], prec = prec, col_width = col_width, aux_pops_width = aux_pops_width)
+                file.write(row + '\n')
 
     # Save selected populations
     def save_used_populations(self, file_path):
@@ -893,6 +1721,20 @@ class Core:
             file.write('\nAuxiliary population names:\n')
             file.write('\n'.join(self.aux_pops_computed))
 
+    # Save a matrix of statistics of pairs of populations, labeled by population names
+    def save_pops_matrix(self, file_path, matrix, pops):
+        prec = 6
+        pops_width = max([len(pop) for pop in pops])
+        col_width = max(prec + 7, pops_width)
+
+        headers = ' '.join(['{0:^{pops_width}}'.format('', pops_width = pops_width)] + ['{0:^{col_width}}'.format(pop, col_width = col_width) for pop in pops])
+        row_format = ' '.join([f'{{{i}: {col_width}.{prec}E}}' for i in range(len(pops))])
+
+        with file_path.open(mode = 'w', encoding = 'utf-8') as file:
+            file.write(headers + '\n')
+            for pop, row in zip(pops, matrix):
+                file.write('{0:{pops_width}} '.format(pop, pops_width = pops_width) + row_format.format(*row) + '\n')
+
     # Save PCA data
     def save_pca_data(self, file_path):
         prec = 6
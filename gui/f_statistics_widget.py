@@ -148,9 +148,9 @@ class FStatisticsWidget(QWidget):
     @Slot()
     def compute_f2(self):
         pops = [item.text() for item in  self.f2_table.selectedItems()]
-        f2 = self.core.compute_f2(pops)
+        f2, f2_error = self.core.compute_f2(pops)
         self.log.clear_entry('f2')
-        self.log.append_entry('f2', f"f2({pops[0]}, {pops[1]}) = {f2:6.4f}")
+        self.log.append_entry('f2', f"f2({pops[0]}, {pops[1]}) = {f2:6.4f} , SE = {f2_error:6.4f} , Z = {f2 / f2_error:6.2f}")
 
     @Slot()
     def compute_f3(self):
@@ -158,8 +158,8 @@ class FStatisticsWidget(QWidget):
         self.log.clear_entry('f3')
         for n in range(3):
             rot_pops = pops[n:] + pops[:n]
-            f3, angle = self.core.compute_f3(rot_pops)
-            self.log.append_entry('f3', f"f3({rot_pops[0]}, {rot_pops[1]}; {rot_pops[2]}) = {f3:6.4f} , angle = {angle:6.2f} deg")
+            f3, angle, f3_error = self.core.compute_f3(rot_pops)
+            self.log.append_entry('f3', f"f3({rot_pops[0]}, {rot_pops[1]}; {rot_pops[2]}) = {f3:6.4f} , SE = {f3_error:6.4f} , Z = {f3 / f3_error:6.2f} , angle = {angle:6.2f} deg")
 
     @Slot()
     def compute_f4(self):
@@ -168,5 +168,5 @@ class FStatisticsWidget(QWidget):
         right_pops = pops[1:]
         for n in range(3):
             rot_pops = [pops[0]] + right_pops[n:] + right_pops[:n]
-            f4, angle = self.core.compute_f4(rot_pops)
-            self.log.append_entry('f4', f"f4({rot_pops[0]}, {rot_pops[1]}; {rot_pops[2]}, {rot_pops[3]}) = {f4:6.4f} , angle = {angle:6.2f} deg")
\ No newline at end of file
+            f4, angle, f4_error = self.core.compute_f4(rot_pops)
+            self.log.append_entry('f4', f"f4({rot_pops[0]}, {rot_pops[1]}; {rot_pops[2]}, {rot_pops[3]}) = {f4:6.4f} , SE = {f4_error:6.4f} , Z = {f4 / f4_error:6.2f} , angle = {angle:6.2f} deg")
\ No newline at end of file
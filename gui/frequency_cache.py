@@ -0,0 +1,133 @@
+#    Mixtum: the geometry of admixture in population genetics.
+#    Copyright (C) 2025  Jose Maria Castelo Ares
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from pathlib import Path
+from hashlib import sha1
+from time import time
+import json, os
+import numpy as np
+
+
+
+class FrequencyCache:
+    def __init__(self, cache_dir = Path.home() / '.cache' / 'mixtum', max_size = 2 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.manifest_path = self.cache_dir / 'manifest.json'
+
+        # Maximum total size in bytes of cached frequencies
+        self.max_size = max_size
+
+        self.enabled = True
+
+    def set_cache_dir(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.manifest_path = self.cache_dir / 'manifest.json'
+
+    def set_max_size(self, max_size):
+        self.max_size = max(0, max_size)
+
+    # Fingerprint of dataset files: size, modification time and hash of their header
+    def fingerprint(self, file_paths, header_size = 65536):
+        digest = sha1()
+        for file_path in file_paths:
+            stat = file_path.stat()
+            digest.update(f'{stat.st_size}:{stat.st_mtime_ns}:'.encode())
+            with file_path.open(mode = 'rb') as file:
+                digest.update(file.read(header_size))
+        return digest.hexdigest()
+
+    # Key of the allele counts of a population: dataset fingerprint, population name, individual indices,
+    # number of SNPs after cutoff and counts type
+    def key(self, fingerprint, pop, indices, num_alleles, dtype):
+        digest = sha1(f'{fingerprint}:{pop}:{num_alleles}:{np.dtype(dtype).str}:'.encode())
+        digest.update(np.array(indices, dtype = 'int64').tobytes())
+        return digest.hexdigest()
+
+    def read_manifest(self):
+        try:
+            with self.manifest_path.open(mode = 'r', encoding = 'utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    # Write manifest atomically, so that concurrent runs never read a partial file
+    def write_manifest(self, manifest):
+        temp_path = self.manifest_path.with_name(f'manifest.{os.getpid()}.tmp')
+        with temp_path.open(mode = 'w', encoding = 'utf-8') as file:
+            json.dump(manifest, file)
+        os.replace(temp_path, self.manifest_path)
+
+    # Load cached derived and called allele counts of several populations, given their keys, as a dictionary of (2 x SNP) arrays
+    def load(self, keys, num_alleles, dtype):
+        if not self.enabled:
+            return {}
+
+        manifest = self.read_manifest()
+
+        freqs = {}
+        dropped = False
+        for key in keys:
+            if key not in manifest:
+                continue
+            try:
+                array = np.load(self.cache_dir / manifest[key]['file'])
+            except (OSError, ValueError):
+                array = None
+            if array is not None and array.shape == (2, num_alleles) and array.dtype == np.dtype(dtype):
+                freqs[key] = array
+                manifest[key]['access'] = time()
+            else:
+                # Entries whose file was deleted or is unreadable no longer count towards the cache size
+                (self.cache_dir / manifest.pop(key)['file']).unlink(missing_ok = True)
+                dropped = True
+
+        if len(freqs) > 0 or dropped:
+            try:
+                self.write_manifest(manifest)
+            except OSError:
+                pass
+
+        return freqs
+
+    # Store allele counts of several populations, given as a dictionary from key to (population, array),
+    # and evict least recently used entries exceeding the maximum cache size
+    def store(self, entries):
+        if not self.enabled or len(entries) == 0:
+            return
+
+        try:
+            self.cache_dir.mkdir(parents = True, exist_ok = True)
+
+            manifest = self.read_manifest()
+
+            for key, (pop, array) in entries.items():
+                file_name = f'{key}.npy'
+                np.save(self.cache_dir / file_name, array)
+                manifest[key] = {'file': file_name, 'pop': pop, 'size': array.nbytes, 'access': time()}
+
+            # Entries whose file was deleted externally are pruned before evicting
+            manifest = {key: entry for key, entry in manifest.items() if (self.cache_dir / entry['file']).is_file()}
+
+            total_size = sum([entry['size'] for entry in manifest.values()])
+            for key in sorted(manifest, key = lambda key: manifest[key]['access']):
+                if total_size <= self.max_size:
+                    break
+                total_size -= manifest[key]['size']
+                (self.cache_dir / manifest.pop(key)['file']).unlink(missing_ok = True)
+
+            self.write_manifest(manifest)
+        except OSError:
+            pass
@@ -0,0 +1,338 @@
+#    Mixtum: the geometry of admixture in population genetics.
+#    Copyright (C) 2025  Jose Maria Castelo Ares
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+from hashlib import sha1
+
+
+class FrequencyMatrix:
+    def __init__(self, pops, counts, memory = None):
+        # Selected populations, and row index of every population stored in the matrix
+        self.pops = list(pops)
+        self.indices = {pop: index for index, pop in enumerate(self.pops)}
+
+        # (2 x population x SNP) matrix of derived allele counts followed by called allele counts,
+        # from which frequencies are derived lazily, with no called alleles at invalid SNPs
+        self.counts = counts
+
+        # Shared memory block backing the counts, if any
+        self.memory = memory
+
+        # Indices of invalid SNPs of every population, combined lazily over selected populations
+        self.invalid = {}
+        self.valid = None
+        self.valid_indices = None
+        self.num_valid = 0
+
+        # Use SNPs observed in the populations of every product instead of SNPs observed in all selected populations
+        self.pairwise = False
+
+        # Skip in products the SNPs with equal frequencies in all selected populations, which add nothing to differences of populations,
+        # still counting them as valid SNPs, and number of SNPs skipped
+        self.compact = False
+        self.num_uninformative = 0
+
+        # Bounds of blocks of contiguous SNPs left out in turn by the block jackknife
+        self.block_bounds = np.array([0, self.num_stored_snps])
+
+        # Products of populations within every block, from which Gram matrices are looked up, with frequencies centered
+        # at a fixed vector, computed once and extended with new populations
+        self.products = None
+        # Products of populations summed over all blocks, from which Gram matrices over all SNPs are looked up
+        self.totals = None
+        self.products_index = {}
+        self.products_valid = None
+        self.center = None
+
+        # Content hash of the counts of every population, computed lazily
+        self.hashes = {}
+
+    # Frequencies of a population at valid SNPs
+    def __getitem__(self, pop):
+        row = self.indices[pop]
+        return self.frequencies(row) if self.num_invalid == 0 else self.frequencies(row, self.valid_indices)
+
+    @property
+    def num_snps(self):
+        self.valid_snps()
+        return self.num_valid
+
+    # Number of SNPs stored, valid or not
+    @property
+    def num_stored_snps(self):
+        return self.counts.shape[2]
+
+    @property
+    def num_invalid(self):
+        return self.num_stored_snps - self.num_snps
+
+    @property
+    def dtype(self):
+        return self.counts.dtype
+
+    def row_indices(self, pops):
+        return np.array([self.indices[pop] for pop in pops], dtype = int)
+
+    # Frequencies at given rows and SNPs of the counts, in double precision for accurate products, and zero where no allele was called
+    def frequencies(self, rows, snps = slice(None)):
+        derived = self.counts[0][rows, snps]
+        called = self.counts[1][rows, snps]
+        freqs = np.zeros(derived.shape)
+        np.divide(derived, called, out = freqs, where = called > 0)
+        return freqs
+
+    # Block of frequencies of several populations at valid SNPs, gathered at once, not a number where not called in pairwise mode
+    def rows(self, pops):
+        indices = self.row_indices(pops)
+        selection = (indices,) if self.num_invalid == 0 else np.ix_(indices, self.valid_indices)
+        rows = self.frequencies(*selection)
+        if self.pairwise:
+            rows[self.counts[1][selection] == 0] = np.nan
+        return rows
+
+    # Hash of the derived and called allele counts of a population at all stored SNPs, equal for populations with identical counts
+    def content_hash(self, pop):
+        if pop not in self.hashes:
+            self.hashes[pop] = sha1(np.ascontiguousarray(self.counts[:, self.indices[pop]]).tobytes()).hexdigest()
+        return self.hashes[pop]
+
+    # Find invalid SNPs of several populations, where no allele was called
+    def find_invalid(self, pops):
+        for pop in pops:
+            self.invalid[pop] = np.flatnonzero(self.counts[1][self.indices[pop]] == 0)
+        self.valid = None
+
+    # Select populations among those stored, without moving their rows
+    def select(self, pops):
+        self.pops = list(pops)
+        self.valid = None
+
+    # Set bounds of jackknife blocks
+    def set_blocks(self, bounds):
+        self.block_bounds = np.asarray(bounds)
+        self.products = None
+        self.totals = None
+
+    @property
+    def num_blocks(self):
+        return self.block_bounds.size - 1
+
+    # Number of valid SNPs within every jackknife block
+    def block_num_snps(self):
+        cumulative = np.concatenate(([0], np.cumsum(self.valid_snps())))
+        return cumulative[self.block_bounds[1:]] - cumulative[self.block_bounds[:-1]]
+
+    # Ranges of SNPs within every jackknife block, of a maximum size, with the index of their block
+    def segments(self, block_snps):
+        for block in range(self.num_blocks):
+            for start in range(self.block_bounds[block], self.block_bounds[block + 1], block_snps):
+                yield block, start, min(start + block_snps, self.block_bounds[block + 1])
+
+    # Use, for every product of differences, the SNPs observed in its populations instead of the SNPs observed in all selected populations
+    def set_pairwise(self, pairwise):
+        if pairwise != self.pairwise:
+            self.pairwise = pairwise
+            self.valid = None
+            self.products = None
+            self.totals = None
+
+    # Skip SNPs with equal frequencies in all selected populations when computing products, except in pairwise mode,
+    # in which they count towards the SNPs observed in every pair of populations
+    def set_compact(self, compact):
+        if compact != self.compact:
+            self.compact = compact
+            self.products = None
+            self.totals = None
+
+    # Mask of SNPs valid for all selected populations, or for at least two of them in pairwise mode
+    def valid_snps(self):
+        if self.valid is None:
+            missing = np.bincount(np.concatenate([self.invalid.get(pop, np.zeros(0, dtype = int)) for pop in self.pops] + [np.zeros(0, dtype = int)]), minlength = self.num_stored_snps)
+            self.valid = len(self.pops) - missing >= 2 if self.pairwise else missing == 0
+            self.valid_indices = np.flatnonzero(self.valid)
+            self.num_valid = self.valid_indices.size
+
+            # Products over another set of SNPs are no longer valid, pairwise products do not depend on it
+            if self.products is not None and not self.pairwise and not np.array_equal(self.valid, self.products_valid):
+                self.products = None
+                self.totals = None
+        return self.valid
+
+    # Centered block of rows over a range of SNPs, with invalid SNPs zeroed so that they do not contribute to products,
+    # centering in place their frequencies if already computed
+    def centered_block(self, indices, start, stop, freqs = None):
+        block = self.frequencies(indices, slice(start, stop)) if freqs is None else freqs
+        block -= self.center[start:stop]
+        block[:, ~self.valid[start:stop]] = 0
+        return block
+
+    # Pairs of factors of the products accumulated over a block of SNPs: centered frequencies, or in pairwise mode
+    # frequencies (zero if not called), their squares and masks of called SNPs, so that masked sums are matrix products
+    # Frequencies of the rows over the range are reused if already computed
+    def factors(self, indices, start, stop, freqs = None):
+        if not self.pairwise:
+            block = self.centered_block(indices, start, stop, freqs)
+            # Centered frequencies vanish at SNPs with equal frequencies in all selected populations
+            if self.compact:
+                block = block[:, np.any(block != 0, axis = 0)]
+            return [(block, block)]
+
+        if freqs is None:
+            freqs = self.frequencies(indices, slice(start, stop))
+        called = (self.counts[1][indices, start:stop] > 0).astype('d')
+        return [(freqs, freqs), (freqs ** 2, called), (called, called)]
+
+    # Number of valid SNPs over a range left out of the factors of products, those with equal frequencies in all their populations in compact mode
+    def num_skipped(self, start, stop, factors):
+        if not self.compact or self.pairwise:
+            return 0
+        return np.count_nonzero(self.valid[start:stop]) - factors[0][0].shape[1]
+
+    # Products of all selected populations within every jackknife block, with frequencies centered at their mean at every SNP,
+    # accumulated over ranges of SNPs so that only a range of rows is held in double precision at a time
+    def compute_products(self, block_snps = 65536):
+        self.valid_snps()
+
+        indices = self.row_indices(self.pops)
+
+        self.center = np.zeros(self.num_stored_snps)
+        self.products = np.zeros((3 if self.pairwise else 1, self.num_blocks, indices.size, indices.size))
+        self.num_uninformative = 0
+        for block, start, stop in self.segments(block_snps):
+            freqs = self.frequencies(indices, slice(start, stop))
+            self.center[start:stop] = np.mean(freqs, axis = 0)
+            if self.compact and not self.pairwise:
+                # Center exactly at the common frequency of SNPs with equal frequencies, so that their centered frequencies are zero
+                uniform = np.all(freqs == freqs[:1], axis = 0)
+                self.center[start:stop][uniform] = freqs[0, uniform]
+            factors = self.factors(indices, start, stop, freqs)
+            self.num_uninformative += self.num_skipped(start, stop, factors)
+            for k, (left, right) in enumerate(factors):
+                self.products[k, block] += left @ right.T
+
+        self.totals = np.sum(self.products, axis = 1)
+        self.products_index = {pop: index for index, pop in enumerate(self.pops)}
+        self.products_valid = self.valid
+
+    # Extend the products with those of new populations, leaving the other products untouched
+    def extend_products(self, pops, block_snps = 65536):
+        num_old = len(self.products_index)
+        indices = np.concatenate((self.row_indices(self.products_index), self.row_indices(pops)))
+
+        products = np.zeros(self.products.shape[:2] + (indices.size, indices.size))
+        products[:, :, :num_old, :num_old] = self.products
+        symmetric = []
+        # SNPs skipped are counted again, since new populations may differ at SNPs with equal frequencies in the old ones
+        self.num_uninformative = 0
+        for block, start, stop in self.segments(block_snps):
+            factors = self.factors(indices, start, stop)
+            self.num_uninformative += self.num_skipped(start, stop, factors)
+            symmetric = [left is right for left, right in factors]
+            for k, (left, right) in enumerate(factors):
+                products[k, block, num_old:] += left[num_old:] @ right.T
+                if not symmetric[k]:
+                    products[k, block, :num_old, num_old:] += left[:num_old] @ right[num_old:].T
+
+        for k in np.flatnonzero(symmetric):
+            products[k, :, :num_old, num_old:] = np.swapaxes(products[k, :, num_old:, :num_old], 1, 2)
+
+        # Totals of old populations are kept, only those involving new populations are summed over blocks
+        totals = np.zeros((products.shape[0],) + products.shape[2:])
+        totals[:, :num_old, :num_old] = self.totals
+        totals[:, num_old:] = np.sum(products[:, :, num_old:], axis = 1)
+        totals[:, :num_old, num_old:] = np.sum(products[:, :, :num_old, num_old:], axis = 1)
+
+        self.products = products
+        self.totals = totals
+        for pop in pops:
+            self.products_index[pop] = len(self.products_index)
+
+    # Reuse the products of another frequency matrix holding the same counts of several populations
+    def adopt_products(self, other, pops, block_snps = 65536):
+        self.valid_snps()
+        if other.products is not None and other.pairwise == self.pairwise and other.compact == self.compact and np.array_equal(self.block_bounds, other.block_bounds) and (self.pairwise or np.array_equal(self.valid, other.products_valid)):
+            pops = [pop for pop in pops if pop in other.products_index]
+            positions = np.array([other.products_index[pop] for pop in pops], dtype = int)
+            self.products = other.products[:, :, positions[:, np.newaxis], positions]
+            self.totals = other.totals[:, positions[:, np.newaxis], positions]
+            self.products_index = {pop: index for index, pop in enumerate(pops)}
+            self.products_valid = self.valid
+            self.center = other.center
+            # SNPs with equal frequencies in the adopted populations, which may be more than in those of the other matrix
+            self.num_uninformative = 0
+            if self.compact and not self.pairwise:
+                indices = self.row_indices(pops)
+                for block, start, stop in self.segments(block_snps):
+                    uniform = np.all(self.centered_block(indices, start, stop) == 0, axis = 0)
+                    self.num_uninformative += np.count_nonzero(uniform & self.valid[start:stop])
+
+    # Gram matrices equivalent to the f2 distances of populations, each averaged over the SNPs observed in both populations,
+    # so that every product of differences divided by the number of valid SNPs is the f-statistic given by f2 distances
+    def pairwise_gram(self, products, squares, called, num_snps):
+        f2 = np.full(products.shape, np.nan)
+        np.divide(squares + np.swapaxes(squares, -1, -2) - 2 * products, called, out = f2, where = called > 0)
+        # Constant terms do not change products of differences, and make the diagonal positive
+        top = np.max(f2, axis = (-2, -1), keepdims = True, initial = 0, where = ~np.isnan(f2))
+        return np.reshape(num_snps, np.shape(num_snps) + (1, 1)) * (top - f2) / 2
+
+    # Positions of several populations within the products of all populations, computing them or extending them with new populations as needed
+    def products_positions(self, pops):
+        self.valid_snps()
+        if self.products is None:
+            self.compute_products()
+
+        new_pops = [pop for pop in dict.fromkeys(pops) if pop not in self.products_index]
+        if len(new_pops) > 0:
+            self.extend_products(new_pops)
+
+        return np.array([self.products_index[pop] for pop in pops], dtype = int)
+
+    # Gram matrix of several populations over all blocks, looked up from the totals of the products of all populations
+    def gram(self, pops):
+        positions = self.products_positions(pops)
+        products = self.totals[:, positions[:, np.newaxis], positions]
+        return self.pairwise_gram(*products, self.num_snps) if self.pairwise else products[0]
+
+    # Gram matrices of several populations leaving out in turn every block with valid SNPs, subtracting its products from the total,
+    # and numbers of valid SNPs of those blocks
+    def block_grams(self, pops):
+        sizes = self.block_num_snps()
+        blocks = np.flatnonzero(sizes > 0)
+
+        positions = self.products_positions(pops)
+        products = self.totals[:, np.newaxis, positions[:, np.newaxis], positions] - self.products[:, blocks[:, np.newaxis, np.newaxis], positions[:, np.newaxis], positions]
+
+        grams = self.pairwise_gram(*products, self.num_snps - sizes[blocks]) if self.pairwise else products[0]
+        return grams, sizes[blocks]
+
+    # Release shared memory block, which stays mapped while arrays still use it
+    def release(self):
+        self.counts = np.zeros((2, len(self.pops), 0), dtype = self.counts.dtype)
+        self.valid = None
+        self.valid_indices = None
+        self.products = None
+        self.totals = None
+        self.hashes = {}
+        if self.memory is not None:
+            try:
+                self.memory.close()
+            except BufferError:
+                pass
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+            self.memory = None
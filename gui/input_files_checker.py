@@ -72,7 +72,7 @@ class InputFilesChecker(QObject):
                 self.geno_file_error.emit()
                 valid = False
             if not self.core.check_ind_and_geno():
-                self.ind_file_error.emit(self.core.num_ind_rows, self.core.num_geno_cols[0])
+                self.ind_file_error.emit(self.core.num_ind_rows, int(self.core.num_geno_cols[0]))
                 valid = False
             if not self.core.check_snp_and_geno():
                 self.snp_file_error.emit(self.core.num_snp_rows, self.core.num_geno_rows)
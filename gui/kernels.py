@@ -0,0 +1,247 @@
+#    Mixtum: the geometry of admixture in population genetics.
+#    Copyright (C) 2025  Jose Maria Castelo Ares
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import signal
+from multiprocessing import get_context, shared_memory
+
+
+ctx = get_context('spawn')
+
+# Cancellation token, handed over to spawned worker processes when they start
+event = ctx.Event()
+
+# Number of bytes decoded from .geno file per chunk
+chunk_bytes = 4 * 1024 * 1024
+
+# Relative tolerance under which products derived from a Gram matrix are taken as zero
+gram_tolerance = 1e-12
+
+# Lookup tables from a packed byte to the derived allele count and called flag of its 4 genotypes
+packed_codes = (np.arange(256, dtype = 'uint8')[:, np.newaxis] >> np.array([6, 4, 2, 0], dtype = 'uint8')) & 3
+packed_derived = np.where(packed_codes == 3, 0, 2 - packed_codes).astype('uint8')
+packed_called = (packed_codes != 3).astype('uint8')
+
+# Get rows of a memory-mapped .geno file as a (snp x row) table of bytes, completing a last row without line break
+def geno_rows(geno, header_size, row_size, start, stop):
+    rows = geno[header_size + start * row_size:header_size + stop * row_size]
+    if rows.size < (stop - start) * row_size:
+        rows = np.concatenate((rows, np.full((stop - start) * row_size - rows.size, ord('\n'), dtype = 'uint8')))
+    return rows.reshape(stop - start, row_size)
+
+# Decode derived allele counts and called flags of selected individuals from packed rows
+def decode_packed_rows(rows, indices):
+    codes = rows[:, indices // 4]
+    positions = indices % 4
+    return packed_derived[codes, positions], packed_called[codes, positions]
+
+# Decode derived allele counts and called flags of selected individuals from text rows
+def decode_ascii_rows(rows, indices):
+    # All rows must have the same width
+    if np.any(rows[:, -1] != ord('\n')):
+        raise ValueError(f'Not all rows of .geno file have {rows.shape[1]} characters')
+    alleles = rows[:, indices] - ord('0')
+    called = alleles != 9
+    return np.where(called, 2 - alleles, 0), called
+
+# Compute derived and called allele counts of a chunk of SNPs given derived allele counts and called flags of individuals of contiguous populations
+def chunk_allele_counts(derived, called, offsets, dtype):
+    derived_sums = np.add.reduceat(derived, offsets, axis = 1, dtype = dtype)
+    called_sums = np.add.reduceat(called, offsets, axis = 1, dtype = dtype)
+    return derived_sums, 2 * called_sums
+
+# Compute allele counts of several populations over a range of SNPs of the .geno file,
+# writing them into their rows of the (2 x population x SNP) matrix held in a shared memory block
+def populations_allele_counts(file_path, geno_file_ascii, header_size, row_size, snp_start, snp_stop, pops_indices, pops_rows, counts_name, counts_shape, counts_dtype):
+    # Index of every selected individual, populations laid out contiguously
+    indices = np.concatenate([np.array(pop_indices, dtype = 'int64') for pop_indices in pops_indices])
+    offsets = np.cumsum([0] + [len(pop_indices) for pop_indices in pops_indices[:-1]])
+
+    counts_memory = shared_memory.SharedMemory(name = counts_name)
+    allele_counts = np.ndarray(counts_shape, dtype = counts_dtype, buffer = counts_memory.buf)
+
+    chunk_size = max(1, chunk_bytes // row_size)
+
+    geno = np.memmap(file_path, dtype = 'uint8', mode = 'r')
+
+    for start in range(snp_start, snp_stop, chunk_size):
+        # Abort computation?
+        if event.is_set():
+            break
+        stop = min(start + chunk_size, snp_stop)
+        # Decode next chunk of rows
+        rows = geno_rows(geno, header_size, row_size, start, stop)
+        if geno_file_ascii:
+            derived, called = decode_ascii_rows(rows, indices)
+        else:
+            derived, called = decode_packed_rows(rows, indices)
+        # Compute counts of all populations
+        derived_counts, called_counts = chunk_allele_counts(derived, called, offsets, counts_dtype)
+        allele_counts[0, pops_rows, start:stop] = derived_counts.T
+        allele_counts[1, pops_rows, start:stop] = called_counts.T
+
+    del geno
+    del allele_counts
+    counts_memory.close()
+
+    return snp_start, snp_stop
+
+# Dot product of the differences (p - q) and (r - s) of populations given their indices in a Gram matrix, or in a stack of them
+def difference_product(gram, p, q, r, s):
+    return gram[..., p, r] - gram[..., p, s] - gram[..., q, r] + gram[..., q, s]
+
+# Products derived from a Gram matrix, or from every Gram matrix of a stack, under which they are taken as zero
+def gram_zero(gram):
+    return gram_tolerance * np.max(np.diagonal(gram, axis1 = -2, axis2 = -1), axis = -1, keepdims = True)
+
+# Bootstrap replicates of alpha and admixture angle post JL (deg), each from a random subset of auxiliary populations
+# Terms are symmetric matrices of the sums over pairs of auxiliary populations, so the sums over the pairs of a subset
+# with membership vector m are the quadratic forms m^T T m / 2, evaluated for all replicates at once
+def bootstrap_replicates(terms, num_pops, num_replicates, seed):
+    if event.is_set():
+        return np.zeros(0), np.zeros(0)
+
+    rng = np.random.default_rng(seed)
+    members = rng.permuted(np.tile(np.arange(terms.shape[1]) < num_pops, (num_replicates, 1)), axis = 1).astype('d')
+
+    abxb, abab, xaxb, xaxa, xbxb = np.sum((members @ terms) * members, axis = 2) / 2
+
+    alpha = abxb / abab
+    angle = np.arccos(np.clip(xaxb / np.sqrt(xaxa * xbxb), -1, 1)) * 180 / np.pi
+
+    return alpha, angle
+
+# Weighted sums over pairs (i < j) of auxiliary populations, sum_ij w_ij (g_pi - g_pj) (g_qi - g_qj), for every pair of populations (p, q),
+# and the parts of those sums over the pairs involving a population t, given a Gram matrix and symmetric weights, zero outside auxiliary pairs
+def pair_sums(gram, weights):
+    degrees = np.sum(weights, axis = 1)
+    weighted = gram @ weights
+
+    total = (gram * degrees) @ gram - weighted @ gram
+
+    partial = (gram[np.newaxis] * weights[:, np.newaxis]) @ gram
+    partial += degrees[:, np.newaxis, np.newaxis] * gram[:, :, np.newaxis] * gram[:, np.newaxis]
+    partial -= gram[:, :, np.newaxis] * weighted.T[:, np.newaxis] + weighted.T[:, :, np.newaxis] * gram[:, np.newaxis]
+
+    return total, partial
+
+# Alpha post JL, admixture angle post JL (deg) and f3 test of admixture models given by indices of hybrid and parent populations in a Gram matrix,
+# the auxiliary pairs of every model being those not involving its own populations, weighted by inverse squared norms of their differences
+def admixture_scan(gram, weights, num_snps, hybrids, parents1, parents2):
+    if event.is_set():
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+
+    total, partial = pair_sums(gram, weights)
+
+    # Sums over the pairs of the model, s[p, q] for p, q in (hybrid, parent 1, parent 2), leaving out pairs involving them
+    models = np.stack([hybrids, parents1, parents2])
+    p = models[:, np.newaxis]
+    q = models[np.newaxis]
+    s = total[p, q] - partial[hybrids, p, q] - partial[parents1, p, q] - partial[parents2, p, q]
+    # Pairs of model populations were left out twice
+    for t, u in ((hybrids, parents1), (hybrids, parents2), (parents1, parents2)):
+        s += weights[t, u] * (gram[p, t] - gram[p, u]) * (gram[q, t] - gram[q, u])
+
+    xaxb = s[0, 0] - s[0, 2] - s[1, 0] + s[1, 2]
+    xaxa = s[0, 0] - 2 * s[0, 1] + s[1, 1]
+    xbxb = s[0, 0] - 2 * s[0, 2] + s[2, 2]
+    abxb = s[1, 0] - s[1, 2] - s[2, 0] + s[2, 2]
+    abab = s[1, 1] - 2 * s[1, 2] + s[2, 2]
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        alpha = abxb / abab
+        angle = np.arccos(np.clip(xaxb / np.sqrt(xaxa * xbxb), -1, 1)) * 180 / np.pi
+
+    f3 = difference_product(gram, hybrids, parents1, hybrids, parents2) / num_snps
+
+    return alpha, angle, f3
+
+# Keep the entries of greatest score among several candidates, at most a given number of them, in decreasing order
+def top_entries(num_top, scores, *values):
+    if scores.size > num_top:
+        top = np.argpartition(-scores, num_top)[:num_top]
+        scores = scores[top]
+        values = [value[top] for value in values]
+    order = np.argsort(-scores, kind = 'stable')
+    return (scores[order],) + tuple(value[order] for value in values)
+
+# Greatest f4 statistics, or cosines of f4 angles, in absolute value, of the pairs (A, B) within a range of left pairs and all right pairs (C, D),
+# given by indices in a Gram matrix, skipping quadruples with repeated populations, and repeated pairs of pairs if left and right pairs are the same
+# Products of pair differences are computed by blocks of left pairs and only the best ones are kept, so memory does not grow with the number of quadruples
+def f4_scan(gram, left, right, start, stop, same_pairs, angle, num_top):
+    best = (np.zeros(0), np.zeros(0), np.zeros(0, dtype = int), np.zeros(0, dtype = int))
+
+    left_norms = difference_product(gram, left[0], left[1], left[0], left[1])
+    right_norms = difference_product(gram, right[0], right[1], right[0], right[1])
+
+    step = max(1, chunk_bytes // (8 * max(1, right[0].size)))
+
+    for block_start in range(start, stop, step):
+        if event.is_set():
+            break
+
+        rows = np.arange(block_start, min(block_start + step, stop))
+
+        # Pairs of pairs already met as left pairs of previous rows are skipped
+        cols = np.arange(block_start + 1 if same_pairs else 0, right[0].size)
+        if cols.size == 0:
+            continue
+
+        # Products of the differences (A - B) with all populations, then with right pairs
+        differences = gram[left[0][rows]] - gram[left[1][rows]]
+        abcd = differences[:, right[0][cols]] - differences[:, right[1][cols]]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            scores = np.abs(abcd / np.sqrt(left_norms[rows, np.newaxis] * right_norms[cols]) if angle else abcd)
+
+        # Only quadruples better than the worst one kept so far are candidates
+        threshold = best[0][-1] if best[0].size == num_top else -np.inf
+        entries = np.flatnonzero(scores > threshold)
+        row, col = rows[entries // cols.size], cols[entries % cols.size]
+
+        a, b, c, d = left[0][row], left[1][row], right[0][col], right[1][col]
+        valid = (a != c) & (a != d) & (b != c) & (b != d)
+        if same_pairs:
+            valid &= col > row
+        entries, row, col = entries[valid], row[valid], col[valid]
+
+        candidates = (scores.ravel()[entries], abcd.ravel()[entries], row, col)
+        best = top_entries(num_top, *[np.concatenate(pair) for pair in zip(best, candidates)])
+
+    return best
+
+# Run a bootstrap task of the worker pool
+def bootstrap_task(task):
+    return bootstrap_replicates(*task)
+
+# Run an admixture model scan task of the worker pool
+def admixture_scan_task(task):
+    return admixture_scan(*task)
+
+# Run an f4 scan task of the worker pool
+def f4_scan_task(task):
+    return f4_scan(*task)
+
+# Run a counts computation task of the worker pool
+def allele_counts_task(task):
+    return populations_allele_counts(*task)
+
+# Initialize a process of the worker pool, which only needs this module, sharing the cancellation token of the main process
+# A spawned process imports this module anew, so its own token would never be set
+def init_worker(stop_event):
+    global event
+    event = stop_event
+    # Interruptions are handled by the main process, which sets the token
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
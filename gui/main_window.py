@@ -159,4 +159,5 @@ class MainWindow(QWidget):
     def closeEvent(self, event):
         self.mix_model_widget.plots_panel = None
         self.input_files_widget.about_dialog.close()
+        self.core.close_pool()
         event.accept()
@@ -90,17 +90,38 @@ class MixModelWidget(QWidget):
         self.compute_button.setEnabled(False)
         self.compute_button.clicked.connect(self.compute_results)
 
+        # Stop computation button
+        self.stop_button = QPushButton('Stop computation')
+        self.stop_button.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.stop_computation)
+
         # Bootstrap checkbox
         self.bootstrap_checkbox = QCheckBox('Bootstrap')
         self.bootstrap_checkbox.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
         self.bootstrap_checkbox.setEnabled(False)
         self.bootstrap_checkbox.toggled.connect(self.set_bootstrap)
 
+        # Bootstrap replicates spinbox
+        self.replicates_spinbox = QSpinBox(minimum = 1, maximum = 1000000, value = self.core.bootstrap_replicates)
+        self.replicates_spinbox.setPrefix('Replicates: ')
+        self.replicates_spinbox.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
+        self.replicates_spinbox.setEnabled(False)
+        self.replicates_spinbox.valueChanged.connect(self.core.set_bootstrap_replicates)
+
+        # Bootstrap seed spinbox, random seed if zero
+        self.seed_spinbox = QSpinBox(minimum = 0, maximum = 2 ** 31 - 1, value = 0)
+        self.seed_spinbox.setPrefix('Seed: ')
+        self.seed_spinbox.setSpecialValueText('Seed: random')
+        self.seed_spinbox.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
+        self.seed_spinbox.setEnabled(False)
+        self.seed_spinbox.valueChanged.connect(self.set_bootstrap_seed)
+
         # Progress bar
         self.progress_bar = QProgressBar()
         self.progress_bar.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Preferred)
         self.progress_bar.setMinimum(0)
-        self.progress_bar.setMaximum(9)
+        self.progress_bar.setMaximum(10)
         self.progress_bar.setValue(0)
         self.progress = 0
 
@@ -176,6 +197,15 @@ class MixModelWidget(QWidget):
         angles_layout = QVBoxLayout(angles_widget)
         angles_layout.addWidget(self.plot_angle)
 
+        # Auxiliary populations influence table widget
+        self.influence_table = QTableWidget()
+        self.influence_table.setColumnCount(4)
+        self.influence_table.setSortingEnabled(True)
+        self.influence_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.influence_table.verticalHeader().setVisible(False)
+        self.influence_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.influence_table.setHorizontalHeaderLabels(['Removed', 'Alpha', 'Angle', 'f4-ratio avg'])
+
         # Detach / attach plots panel button
         self.detach_button = QPushButton('Detach plots')
         self.detach_button.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
@@ -188,6 +218,7 @@ class MixModelWidget(QWidget):
         # self.tab_widget.addTab(std_widget, 'Standard admixture')
         self.tab_widget.addTab(f4_ratio_histogram_widget, 'f4 ratio histogram')
         self.tab_widget.addTab(angles_widget, 'Angles')
+        self.tab_widget.addTab(self.influence_table, 'Auxiliary influence')
 
         # Alpha out of range label
         alpha_label = QLabel('Proportions out of range')
@@ -235,6 +266,9 @@ class MixModelWidget(QWidget):
         llayout = QHBoxLayout()
         llayout.addWidget(self.compute_button)
         llayout.addWidget(self.bootstrap_checkbox)
+        llayout.addWidget(self.replicates_spinbox)
+        llayout.addWidget(self.seed_spinbox)
+        llayout.addWidget(self.stop_button)
         llayout.addWidget(self.progress_bar)
         llayout.addWidget(self.save_f4_button)
         llayout.addWidget(self.save_results_button)
@@ -279,6 +313,7 @@ class MixModelWidget(QWidget):
         self.plot_histogram.clear('Histogram', 'x', 'y')
         self.plot_bars.clear('Admix', '', '', show_axes = False)
         self.plot_angle.clear('Angles', '', '', polar = True)
+        self.influence_table.setRowCount(0)
 
         self.hybrid_table.setRowCount(0)
         self.parent1_table.setRowCount(0)
@@ -377,6 +412,10 @@ class MixModelWidget(QWidget):
         self.check_aux_table_selection()
         self.set_buttons()
 
+        # Once results are shown, update them with the contributions of the toggled auxiliary populations, unless too many to keep
+        if self.save_results_button.isEnabled() and len(self.core.aux_pops) >= 4 and self.core.update_aux_pops(self.core.aux_pops):
+            self.output_results()
+
     def set_buttons(self):
         self.compute_button.setEnabled(len(self.aux_table.selectedItems()) >= 4)
         self.bootstrap_checkbox.setEnabled(len(self.aux_table.selectedItems()) >= 8)
@@ -386,6 +425,12 @@ class MixModelWidget(QWidget):
     @Slot()
     def set_bootstrap(self, checked):
         self.core.bootstrap = checked
+        self.replicates_spinbox.setEnabled(checked)
+        self.seed_spinbox.setEnabled(checked)
+
+    @Slot(int)
+    def set_bootstrap_seed(self, seed):
+        self.core.set_bootstrap_seed(seed if seed > 0 else None)
 
     @Slot()
     def set_progress_bar_value(self, step):
@@ -395,12 +440,16 @@ class MixModelWidget(QWidget):
 
     def output_results(self):
         results_text = self.core.admixture_data()
+        duplicates = self.core.duplicate_aux_pairs(self.core.aux_pops_computed)
+        if len(duplicates) > 0:
+            results_text += '\n---\nIdentical or near-identical auxiliary populations:\n' + '\n'.join(f'{pop1} ~ {pop2} (f2 = {f2:.3E})' for pop1, pop2, f2 in duplicates)
         self.log.set_entry('main', results_text)
 
         self.plot_prime.plot_fit(self.core.f4ab_prime, self.core.f4xb_prime, self.core.alpha, f'Renormalized admixture: {self.core.hybrid_pop} = alpha {self.core.parent1_pop} + (1 - alpha) {self.core.parent2_pop}', f"f4'({self.core.parent1_pop}, {self.core.parent2_pop}; i, j)", f"f4'({self.core.hybrid_pop}, {self.core.parent2_pop}; i, j)")
         # self.plot_std.plot_fit(self.core.f4ab_std, self.core.f4xb_std, self.core.alpha_std, f'Standard admixture: {self.core.hybrid_pop} = alpha {self.core.parent1_pop} + (1 - alpha) {self.core.parent2_pop}', f"f4({self.core.parent1_pop}, {self.core.parent2_pop}; i, j)", f"f4({self.core.hybrid_pop}, {self.core.parent2_pop}; i, j)")
         self.plot_histogram.plot_histogram(self.core.alpha_ratio_hist, f'{self.core.hybrid_pop} = alpha {self.core.parent1_pop} + (1 - alpha) {self.core.parent2_pop}', 'f4 ratio', 'Counts')
         self.plot_angle.plot_angle('Angles', [self.core.angle_pre_jl, self.core.angle_post_jl])
+        self.populate_influence_table()
 
         if 0 <= self.core.alpha <= 1:
             self.plot_bars.plot_bars(self.core.hybrid_pop, self.core.parent1_pop, self.core.parent2_pop, self.core.alpha)
@@ -413,24 +462,38 @@ class MixModelWidget(QWidget):
         self.bins_spinbox.setEnabled(True)
         self.export_cmd_button.setEnabled(True)
 
-    def results_computed(self, worker_name):
-        if worker_name == 'results':
-            if self.core.bootstrap:
-                self.compute_bootstrap()
-            else:
-                self.output_results()
+    # Fill table with results leaving out every auxiliary population in turn, sortable by their values
+    def populate_influence_table(self):
+        self.core.compute_aux_influence()
+
+        self.influence_table.setSortingEnabled(False)
+        self.influence_table.clearContents()
+        self.influence_table.setRowCount(len(self.core.aux_influence))
 
-                self.hybrid_table.setEnabled(True)
-                self.parent1_table.setEnabled(True)
-                self.parent2_table.setEnabled(True)
-                self.aux_table.setEnabled(True)
-        elif worker_name == 'bootstrap':
+        for row, (pop, alpha, angle, ratio_avg) in enumerate(self.core.aux_influence):
+            self.influence_table.setItem(row, 0, QTableWidgetItem(pop))
+            for column, value in enumerate([round(float(alpha), 4), round(float(angle), 2), round(float(ratio_avg), 4)], 1):
+                item = QTableWidgetItem()
+                item.setData(Qt.ItemDataRole.DisplayRole, value)
+                self.influence_table.setItem(row, column, item)
+
+        self.influence_table.setSortingEnabled(True)
+
+    def results_computed(self, worker_name):
+        if self.core.computation_stopped():
+            self.log.set_entry('main', 'Computation stopped!')
+        elif worker_name == 'results' and self.core.bootstrap:
+            self.compute_bootstrap()
+            return
+        else:
             self.output_results()
 
-            self.hybrid_table.setEnabled(True)
-            self.parent1_table.setEnabled(True)
-            self.parent2_table.setEnabled(True)
-            self.aux_table.setEnabled(True)
+        self.stop_button.setEnabled(False)
+
+        self.hybrid_table.setEnabled(True)
+        self.parent1_table.setEnabled(True)
+        self.parent2_table.setEnabled(True)
+        self.aux_table.setEnabled(True)
 
     @Slot()
     def on_compute_error(self, info):
@@ -444,10 +507,10 @@ class MixModelWidget(QWidget):
         worker.signals.finished.connect(self.results_computed)
 
         if self.core.bootstrap:
-            num_bootstrap_pops, num_bootstrap_its = self.core.get_bootstrap_conditions()
-            self.progress_bar.setMaximum(9 + num_bootstrap_its)
+            num_bootstrap_pops, num_replicates, num_bootstrap_tasks = self.core.get_bootstrap_conditions()
+            self.progress_bar.setMaximum(10 + num_bootstrap_tasks)
         else:
-            self.progress_bar.setMaximum(9)
+            self.progress_bar.setMaximum(10)
 
         self.progress = 0
 
@@ -456,6 +519,8 @@ class MixModelWidget(QWidget):
         self.parent2_table.setEnabled(False)
         self.aux_table.setEnabled(False)
 
+        self.stop_button.setEnabled(True)
+
         self.thread_pool.start(worker)
 
     def compute_bootstrap(self):
@@ -466,6 +531,10 @@ class MixModelWidget(QWidget):
 
         self.thread_pool.start(worker)
 
+    @Slot()
+    def stop_computation(self):
+        self.core.stop_computation()
+
     @Slot(int)
     def compute_histogram(self, bins):
         self.core.compute_f4_ratio_histogram(bins)
@@ -539,8 +608,16 @@ class MixModelWidget(QWidget):
         command_text = f"python mixtum.py --geno \"{self.core.geno_file_path}\" --ind \"{self.core.ind_file_path}\" --snp \"{self.core.snp_file_path}\" --pops \"{pops_file_name}\" --outdir \"{outdir_name}\" --nprocs {self.core.num_procs}"
         if self.core.snp_cutoff < self.core.num_snp:
             command_text += f" --snp-cutoff {self.core.snp_cutoff}"
+        if self.core.pairwise_complete:
+            command_text += f" --pairwise-complete"
+        if self.core.compact_snps:
+            command_text += f" --compact-snps"
+        if not self.core.frequency_cache.enabled:
+            command_text += f" --no-cache"
         if self.core.bootstrap:
-            command_text += f" --bootstrap"
+            command_text += f" --bootstrap --bootstrap-replicates {self.core.bootstrap_replicates}"
+            if self.core.bootstrap_seed is not None:
+                command_text += f" --bootstrap-seed {self.core.bootstrap_seed}"
 
         # Write to file
         cmd_file_path = Path(cmd_file_name)
@@ -21,7 +21,7 @@ from gui.worker import Worker
 from pathlib import Path
 
 from PySide6.QtCore import Qt, Signal, Slot, QThreadPool
-from PySide6.QtWidgets import QWidget, QTableWidget, QTableWidgetItem, QPushButton, QSizePolicy, QFrame, QSpinBox
+from PySide6.QtWidgets import QWidget, QTableWidget, QTableWidgetItem, QPushButton, QSizePolicy, QFrame, QSpinBox, QCheckBox
 from PySide6.QtWidgets import QProgressBar, QVBoxLayout, QHBoxLayout, QFormLayout, QGroupBox, QHeaderView, QFileDialog
 
 
@@ -91,6 +91,24 @@ class SelectPopsWidget(QWidget):
         self.snp_cutoff_spin_box.setValue(self.core.min_snp_cutoff)
         self.snp_cutoff_spin_box.setEnabled(False)
 
+        # Pairwise-complete SNPs checkbox
+        self.pairwise_checkbox = QCheckBox('Pairwise-complete SNPs')
+        self.pairwise_checkbox.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
+        self.pairwise_checkbox.setChecked(self.core.pairwise_complete)
+        self.pairwise_checkbox.toggled.connect(self.set_pairwise_complete)
+
+        # Compact SNPs checkbox
+        self.compact_checkbox = QCheckBox('Skip monomorphic SNPs')
+        self.compact_checkbox.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
+        self.compact_checkbox.setChecked(self.core.compact_snps)
+        self.compact_checkbox.toggled.connect(self.set_compact_snps)
+
+        # Cache checkbox
+        self.cache_checkbox = QCheckBox('Cache frequencies')
+        self.cache_checkbox.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
+        self.cache_checkbox.setChecked(self.core.frequency_cache.enabled)
+        self.cache_checkbox.toggled.connect(self.set_cache)
+
         # Compute allele frequencies files button
         self.comp_button = QPushButton('Compute frequencies')
         self.comp_button.setSizePolicy(QSizePolicy.Policy.Maximum, QSizePolicy.Policy.Maximum)
@@ -161,6 +179,9 @@ class SelectPopsWidget(QWidget):
         clayout = QHBoxLayout()
         clayout.addLayout(npflayout)
         clayout.addLayout(coflayout)
+        clayout.addWidget(self.pairwise_checkbox)
+        clayout.addWidget(self.compact_checkbox)
+        clayout.addWidget(self.cache_checkbox)
         clayout.addWidget(self.comp_button)
         clayout.addWidget(self.stop_button)
         clayout.addWidget(self.progress_bar)
@@ -233,6 +254,18 @@ class SelectPopsWidget(QWidget):
     def set_num_procs(self, procs):
         self.core.set_num_procs(procs)
 
+    @Slot(bool)
+    def set_pairwise_complete(self, pairwise):
+        self.core.set_pairwise_complete(pairwise)
+
+    @Slot(bool)
+    def set_compact_snps(self, compact):
+        self.core.set_compact_snps(compact)
+
+    @Slot(bool)
+    def set_cache(self, enabled):
+        self.core.set_cache(enabled)
+
     @Slot()
     def set_snp_cutoff_spin_box(self):
         self.snp_cutoff_spin_box.setMaximum(self.core.num_snp)
@@ -260,7 +293,7 @@ class SelectPopsWidget(QWidget):
         self.log.clear_entry('timing')
         self.log.clear_entry('check')
 
-        self.progress_bar.setMaximum(len(self.core.selected_pops))
+        self.progress_bar.setMaximum(100)
 
         self.stop_button.setEnabled(True)
 
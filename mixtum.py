@@ -14,11 +14,9 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import argparse, sys
+import argparse, signal, sys
 from pathlib import Path
 
-from gui.core import Core
-
 
 
 # Raise error if file not found
@@ -40,40 +38,64 @@ class Helper():
         self.core = core
         self.input_files_messages = { 'geno': '', 'ind': '', 'snp': '', 'pops': '' }
         self.output_path = None
-        self.num_bootstrap_its = 0
+        self.num_bootstrap_tasks = 0
+        self.models = False
+        self.influence = False
+        self.exclude_duplicates = False
+        self.freqs_progress = -1
 
-    def set_input_paths(self, geno_file_str, ind_file_str, snp_file_str, pops_file_str):
+    def set_input_paths(self, geno_file_str, ind_file_str, snp_file_str, pops_file_str, models_file_str):
         geno_file_path = Path(geno_file_str)
         ind_file_path = Path(ind_file_str)
         snp_file_path = Path(snp_file_str)
-        pops_file_path = Path(pops_file_str)
 
         check_file_path(geno_file_path)
         check_file_path(ind_file_path)
         check_file_path(snp_file_path)
-        check_file_path(pops_file_path)
 
         self.core.set_geno_file_path(args.geno)
         self.core.set_ind_file_path(args.ind)
         self.core.set_snp_file_path(args.snp)
-        self.core.set_pops_file_path(args.pops)
+
+        # Populations are those of the models if given
+        if models_file_str is not None:
+            models_file_path = Path(models_file_str)
+            check_file_path(models_file_path)
+            self.core.set_models_file_path(models_file_path)
+            self.models = True
+        else:
+            pops_file_path = Path(pops_file_str)
+            check_file_path(pops_file_path)
+            self.core.set_pops_file_path(pops_file_path)
 
     def print_input_files_progress(self, key, message):
         self.input_files_messages[key] = message
 
     def print_freqs_computation_progress(self, *args):
         if len(args) == 1 and isinstance(args[0], int):
-            print(f'{100 * args[0] / len(self.core.selected_pops):.2f}%')
+            if args[0] != self.freqs_progress:
+                self.freqs_progress = args[0]
+                print(f'{args[0]}%')
         elif len(args) == 3 and isinstance(args[0], str) and isinstance(args[1], str) and isinstance(args[2], int):
             print(args[1])
 
     def print_computation_progress(self, index):
-        if index % 3 == 0 or index == 9:
-            print(f'{100 * index / 9:.1f}%', end = ' ', flush = True)
+        if index % 3 == 0 or index == 10:
+            print(f'{100 * index / 10:.1f}%', end = ' ', flush = True)
 
     def print_bootstrap_progress(self, index):
-        if index % 5 == 0 or index == self.num_bootstrap_its:
-            print(f'{100 * index / self.num_bootstrap_its:.1f}%', end = ' ', flush = True)
+        if index % 5 == 0 or index == self.num_bootstrap_tasks:
+            print(f'{100 * index / self.num_bootstrap_tasks:.1f}%', end = ' ', flush = True)
+
+    # Stop computation on first interruption, so that it cleans up, and abort on the next one
+    def interrupt(self, signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        self.core.stop_computation()
+
+    def stop(self):
+        self.core.close_pool()
+        print('\nComputation stopped!')
+        sys.exit(1)
 
     def run(self, num_procs):
         self.core.set_num_procs(num_procs)
@@ -82,11 +104,182 @@ class Helper():
 
         self.process_input_files()
         self.check_snp_cutoff()
+
+        signal.signal(signal.SIGINT, self.interrupt)
+
         self.compute_frequencies()
         self.check_singularities()
         self.compute_results()
         self.save_output_files()
 
+        self.core.close_pool()
+
+    # Evaluate all admixture models of the models file, computing frequencies of all their populations once
+    def run_models(self, num_procs, f4_points):
+        self.core.set_num_procs(num_procs)
+
+        print(f'Mixtum v{self.core.version}\n')
+
+        self.process_input_files()
+        self.check_snp_cutoff()
+
+        errors = self.core.check_models()
+        if len(errors) > 0:
+            print('\n'.join(errors))
+            sys.exit(1)
+
+        signal.signal(signal.SIGINT, self.interrupt)
+
+        self.compute_frequencies()
+        self.compute_models(f4_points)
+
+        self.core.close_pool()
+
+    def print_models_progress(self, index):
+        if index % 10 == 0 or index == len(self.core.models):
+            print(f'{100 * index / len(self.core.models):.1f}%', end = ' ', flush = True)
+
+    def compute_models(self, f4_points):
+        print(f'\nComputing {len(self.core.models)} admixture models...')
+        if not self.core.compute_models(self.print_models_progress, self.output_path if f4_points else None):
+            self.stop()
+
+        print('\n\nResults:')
+        print(self.core.models_data())
+
+        print('\nSaving output files...')
+        self.core.save_models_results(self.output_path.joinpath(Path('models.dat')))
+        print('Done!')
+
+    # Compute matrices of f-statistics among all populations in the selected populations file
+    def run_fstats(self, num_procs, f2, outgroups, targets):
+        self.core.set_num_procs(num_procs)
+
+        print(f'Mixtum v{self.core.version}\n')
+
+        self.process_input_files()
+        self.check_snp_cutoff()
+
+        missing_pops = [pop for pop in (outgroups or []) + (targets or []) if pop not in self.core.selected_pops]
+        if len(missing_pops) > 0:
+            print(f'Error: The following populations are not selected: {','.join(missing_pops)}')
+            sys.exit(1)
+
+        signal.signal(signal.SIGINT, self.interrupt)
+
+        self.compute_frequencies()
+        self.compute_fstats(f2, outgroups or [], targets or [])
+
+        self.core.close_pool()
+
+    def compute_fstats(self, f2, outgroups, targets):
+        pops = self.core.selected_pops
+
+        print('\nSaving output files...')
+
+        if f2:
+            self.core.save_pops_matrix(self.output_path.joinpath(Path('f2.dat')), self.core.f2_matrix(pops), pops)
+
+        for outgroup in outgroups:
+            others = [pop for pop in pops if pop != outgroup]
+            self.core.save_pops_matrix(self.output_path.joinpath(Path(f'f3_outgroup_{outgroup}.dat')), self.core.f3_matrix(outgroup, others), others)
+
+        for target in targets:
+            others = [pop for pop in pops if pop != target]
+            f3 = self.core.f3_matrix(target, others)
+            self.core.save_pops_matrix(self.output_path.joinpath(Path(f'f3_admixture_{target}.dat')), f3, others)
+
+            # Most negative statistics, evidence of the target being admixed
+            pairs = sorted((f3[i, j], i, j) for i in range(len(others)) for j in range(i + 1, len(others)))
+            print(f'\nLowest f3(A, B; {target}):')
+            for value, i, j in pairs[:10]:
+                print(f'{others[i]} {others[j]} {value: .6E}')
+
+        print('Done!')
+
+    # Scan f4 statistics over all quadruples of populations in the selected populations file
+    def run_f4_scan(self, num_procs, left_pops, right_pops, angle, num_top):
+        self.core.set_num_procs(num_procs)
+
+        print(f'Mixtum v{self.core.version}\n')
+
+        self.process_input_files()
+        self.check_snp_cutoff()
+
+        missing_pops = [pop for pop in (left_pops or []) + (right_pops or []) if pop not in self.core.selected_pops]
+        if len(missing_pops) > 0:
+            print(f'Error: The following populations are not selected: {','.join(missing_pops)}')
+            sys.exit(1)
+
+        for side, pops in (('left', left_pops), ('right', right_pops)):
+            if len(dict.fromkeys(pops or self.core.selected_pops)) < 2:
+                print(f'Error: at least two {side} populations are needed to scan f4 statistics.')
+                sys.exit(1)
+
+        signal.signal(signal.SIGINT, self.interrupt)
+
+        self.compute_frequencies()
+
+        print('\nScanning f4 statistics...')
+        if not self.core.scan_f4(self.print_f4_scan_progress, left_pops, right_pops, angle, num_top):
+            self.stop()
+
+        print(f'\n\nBest {len(self.core.f4_scan_results)} quadruples by {'angle' if angle else 'absolute f4'}:')
+        print(self.core.f4_scan_data())
+
+        print('\nSaving output files...')
+        self.core.save_f4_scan_results(self.output_path.joinpath(Path('f4_scan.dat')))
+        print('Done!')
+
+        self.core.close_pool()
+
+    def print_f4_scan_progress(self, index):
+        print(f'{100 * index / self.core.num_f4_scan_tasks:.1f}%', end = ' ', flush = True)
+
+    # Scan admixture models among all populations in the selected populations file
+    def run_scan(self, num_procs, hybrid_pops, aux_pops, num_models):
+        self.core.set_num_procs(num_procs)
+
+        print(f'Mixtum v{self.core.version}\n')
+
+        self.process_input_files()
+        self.check_snp_cutoff()
+
+        missing_pops = [pop for pop in (hybrid_pops or []) + (aux_pops or []) if pop not in self.core.selected_pops]
+        if len(missing_pops) > 0:
+            print(f'Error: The following populations are not selected: {','.join(missing_pops)}')
+            sys.exit(1)
+
+        # Models need at least 4 auxiliary populations besides their own ones, which are auxiliary if not enough others are selected
+        pops = self.core.selected_pops
+        num_aux = len(set(aux_pops or pops))
+        num_others = len([pop for pop in pops if pop not in (aux_pops or pops)])
+        if num_aux - max(0, 3 - num_others) < 4:
+            print('Error: less than 4 auxiliary populations in every admixture model.')
+            sys.exit(1)
+
+        signal.signal(signal.SIGINT, self.interrupt)
+
+        self.compute_frequencies()
+        self.scan_models(hybrid_pops, aux_pops, num_models)
+
+        self.core.close_pool()
+
+    def print_scan_progress(self, index):
+        print(f'{100 * index / self.core.num_procs:.1f}%', end = ' ', flush = True)
+
+    def scan_models(self, hybrid_pops, aux_pops, num_models):
+        print('\nScanning admixture models...')
+        if not self.core.scan_admixture_models(self.print_scan_progress, hybrid_pops = hybrid_pops, aux_pops = aux_pops):
+            self.stop()
+
+        print(f'\n\nBest {min(num_models, len(self.core.scan_results))} of {len(self.core.scan_results)} models:')
+        print(self.core.scan_data(num_models))
+
+        print('\nSaving output files...')
+        self.core.save_scan_results(self.output_path.joinpath(Path('scan.dat')))
+        print('Done!')
+
     def process_input_files(self):
         print('Parsing and checking input files...')
 
@@ -134,7 +327,12 @@ class Helper():
         print('Parsed input files seem to have a valid structure.')
 
     def parse_pops_file(self):
-        self.core.parse_selected_populations(self.print_input_files_progress)
+        if self.models:
+            if not self.core.parse_models_file(self.print_input_files_progress):
+                print('Error in models file: every model must have a hybrid and two parent populations.')
+                sys.exit(1)
+        else:
+            self.core.parse_selected_populations(self.print_input_files_progress)
         missing_pops = self.core.check_parsed_pops()
         if len(missing_pops) > 0:
             print(f'Warning: The following populations are missing from .ind file and were deselected: {','.join(missing_pops)}')
@@ -145,7 +343,9 @@ class Helper():
             sys.exit(1)
 
     def compute_frequencies(self):
-        self.core.parallel_compute_populations_frequencies(self.print_freqs_computation_progress)
+        if not self.core.parallel_compute_populations_frequencies(self.print_freqs_computation_progress):
+            self.core.close_pool()
+            sys.exit(1)
 
     def check_singularities(self):
         singularities = self.core.check_singularities()
@@ -160,19 +360,36 @@ class Helper():
             print('\n'.join(error_messages))
             sys.exit(1)
 
+        duplicates = self.core.duplicate_aux_pairs()
+        if len(duplicates) > 0:
+            print('\nIdentical or near-identical auxiliary populations:')
+            for pop1, pop2, f2 in duplicates:
+                print(f'{pop1} ~ {pop2} (f2 = {f2:.3E})')
+            if self.exclude_duplicates:
+                excluded = self.core.exclude_duplicate_aux_pops()
+                print(f'Excluded auxiliary populations: {" ".join(excluded)}')
+
     def compute_results(self):
         print('\nComputing admixture...')
-        self.core.init_admixture_model()
-        self.core.compute_results(self.print_computation_progress)
+        if not self.core.compute_results(self.print_computation_progress):
+            self.stop()
 
         if self.core.bootstrap:
-            num_bootstrap_pops, self.num_bootstrap_its = self.core.get_bootstrap_conditions()
-            print(f'\n\nPerforming bootstrap using {num_bootstrap_pops} auxiliary populations in {self.num_bootstrap_its} iterations...')
-            self.core.compute_bootstrap(self.print_bootstrap_progress)
+            num_bootstrap_pops, num_replicates, self.num_bootstrap_tasks = self.core.get_bootstrap_conditions()
+            print(f'\n\nPerforming bootstrap using {num_bootstrap_pops} auxiliary populations in {num_replicates} replicates...')
+            if not self.core.compute_bootstrap(self.print_bootstrap_progress):
+                self.stop()
 
         print('\n\nResults:')
         print(self.core.admixture_data())
 
+        if self.influence:
+            if self.core.compute_aux_influence():
+                print('\nResults leaving out every auxiliary population:')
+                print(self.core.aux_influence_data())
+            else:
+                print('\nToo many auxiliary pairs to compute results leaving out every auxiliary population')
+
     def plot(self):
         self.core.plot()
 
@@ -185,37 +402,123 @@ class Helper():
         self.core.save_population_allele_frequencies(self.output_path.joinpath(Path('frequencies.dat')))
         self.core.save_f4_points(self.output_path.joinpath(Path('f4.dat')))
         self.core.save_admixture_data(self.output_path.joinpath(Path('admixture.dat')))
+        if self.influence and len(self.core.aux_influence) > 0:
+            self.core.save_aux_influence(self.output_path.joinpath(Path('influence.dat')))
         print('Done!')
 
-    def set_bootstrap(self, bootstrap):
+    def set_bootstrap(self, bootstrap, num_replicates, seed):
         if bootstrap:
             self.core.bootstrap = True
+        self.core.set_bootstrap_replicates(num_replicates)
+        self.core.set_bootstrap_seed(seed)
+
+    def set_max_f4_points(self, num_points):
+        self.core.set_max_f4_points(num_points if num_points > 0 else None)
+
+    def set_exclude_duplicates(self, exclude):
+        if exclude:
+            self.exclude_duplicates = True
+
+    def set_near_duplicate_f2(self, fraction):
+        self.core.set_near_duplicate_f2(fraction)
+
+    def set_influence(self, influence):
+        if influence:
+            self.influence = True
 
     def set_snp_cutoff(self, n):
         self.core.set_snp_cutoff(n)
 
+    def set_pairwise_complete(self, pairwise):
+        if pairwise:
+            self.core.set_pairwise_complete(True)
+
+    def set_compact_snps(self, compact):
+        if compact:
+            self.core.set_compact_snps(True)
+
+    def set_cache(self, enabled, cache_dir, cache_size):
+        self.core.set_cache(enabled, cache_dir, cache_size * 1024 ** 2)
+
 if __name__ == '__main__':
+    # Imported here so that spawned worker processes only import the computation kernels
+    from gui.core import Core
+
     core = Core()
 
     parser = argparse.ArgumentParser(description = f'Mixtum v{core.version}: The geometry of admixture in population genetics')
     parser.add_argument('--geno', type = str, required = True, help = 'path of .geno file')
     parser.add_argument('--ind', type = str, required = True, help = 'path of .ind file')
     parser.add_argument('--snp', type = str, required = True, help = 'path of .snp file')
-    parser.add_argument('--pops', type = str, required = True, help = 'path of selected populations file (1st row = hybrid, 2nd & 3rd rows = parents, next rows = aux pops)')
+    pops_group = parser.add_mutually_exclusive_group(required = True)
+    pops_group.add_argument('--pops', type = str, help = 'path of selected populations file (1st row = hybrid, 2nd & 3rd rows = parents, next rows = aux pops)')
+    pops_group.add_argument('--models', type = str, help = 'path of admixture models file, evaluating all models at once: .json list of objects with hybrid, parent1, parent2 and aux keys, or rows of hybrid, parents and aux pops (all other pops if none)')
     parser.add_argument('--outdir', type = str, required = True, help = 'path of output dir')
     parser.add_argument('--nprocs', type = int, default = 1, help = 'number of parallel computation processes (default %(default)s)')
     parser.add_argument('--snp-cutoff', type = int, default = 0, help = 'limit number of snp (min. 5000), set value <= 0 for no limit (default %(default)s)')
+    parser.add_argument('--pairwise-complete', action = argparse.BooleanOptionalAction, help = 'compute every f-statistic over the snp observed in its populations, instead of excluding snp missing in any selected population')
+    parser.add_argument('--compact-snps', action = argparse.BooleanOptionalAction, help = 'skip snp with equal frequencies in all selected populations when computing products, still counting them in f-statistics (not with --pairwise-complete)')
+    parser.add_argument('--cache', action = argparse.BooleanOptionalAction, default = True, help = 'reuse and store computed allele frequencies in a cache (default %(default)s)')
+    parser.add_argument('--cache-dir', type = str, default = str(Path.home() / '.cache' / 'mixtum'), help = 'path of allele frequencies cache dir (default %(default)s)')
+    parser.add_argument('--cache-size', type = int, default = 2048, help = 'maximum size of allele frequencies cache in megabytes, least recently used frequencies are evicted (default %(default)s)')
     parser.add_argument('--bootstrap', action = argparse.BooleanOptionalAction, help = 'perform bootstrap')
+    parser.add_argument('--bootstrap-replicates', type = int, default = 1000, help = 'number of bootstrap replicates (default %(default)s)')
+    parser.add_argument('--bootstrap-seed', type = int, default = None, help = 'seed of bootstrap random streams, for reproducible results (default: random)')
+    parser.add_argument('--influence', action = argparse.BooleanOptionalAction, help = 'compute alpha, angle and f4-ratio average leaving out every auxiliary population in turn')
+    parser.add_argument('--f4-points', action = argparse.BooleanOptionalAction, help = 'save f4 points of every model of the models file')
+    parser.add_argument('--max-f4-points', type = int, default = 10000, help = 'maximum number of saved and plotted f4 points, sampled uniformly among auxiliary pairs when their sums are accumulated by blocks of pairs, set value <= 0 to keep all (default %(default)s)')
+    parser.add_argument('--exclude-duplicates', action = argparse.BooleanOptionalAction, help = 'exclude auxiliary populations identical or near-identical to a preceding one')
+    parser.add_argument('--near-duplicate-f2', type = float, default = 0.001, help = 'report auxiliary populations as near-identical if their f2 distance is under this fraction of the median f2 distance of auxiliary pairs, set value <= 0 to report only identical ones (default %(default)s)')
     parser.add_argument('--plot', action = argparse.BooleanOptionalAction, help='plot fits and histogram')
 
+    subparsers = parser.add_subparsers(dest = 'command', title = 'commands')
+    fstats_parser = subparsers.add_parser('fstats', help = 'compute matrices of f-statistics among all populations in the selected populations file')
+    fstats_parser.add_argument('--f2', action = argparse.BooleanOptionalAction, default = True, help = 'save matrix of f2 distances (default %(default)s)')
+    fstats_parser.add_argument('--outgroup', type = str, nargs = '+', help = 'save matrix of outgroup f3(A, B; outgroup) statistics for these outgroups')
+    fstats_parser.add_argument('--target', type = str, nargs = '+', help = 'save matrix of admixture f3(A, B; target) statistics for these targets')
+
+    f4_scan_parser = subparsers.add_parser('f4scan', help = 'scan f4(A, B; C, D) statistics over all quadruples of populations in the selected populations file, keeping the greatest ones')
+    f4_scan_parser.add_argument('--left', type = str, nargs = '+', help = 'populations A, B (default: all)')
+    f4_scan_parser.add_argument('--right', type = str, nargs = '+', help = 'populations C, D (default: all)')
+    f4_scan_parser.add_argument('--rank', choices = ['f4', 'angle'], default = 'f4', help = 'rank quadruples by absolute f4, or by how far their angle is from 90 deg (default %(default)s)')
+    f4_scan_parser.add_argument('--top', type = int, default = 100, help = 'number of quadruples kept (default %(default)s)')
+
+    scan_parser = subparsers.add_parser('scan', help = 'scan admixture models of every hybrid and pair of parents among all populations in the selected populations file')
+    scan_parser.add_argument('--hybrid', type = str, nargs = '+', help = 'scan only these hybrid populations (default: all)')
+    scan_parser.add_argument('--aux', type = str, nargs = '+', help = 'auxiliary populations (default: all populations not in the model)')
+    scan_parser.add_argument('--top', type = int, default = 20, help = 'number of best models printed, all are saved (default %(default)s)')
+
     args = parser.parse_args()
 
     helper = Helper(core)
 
-    helper.set_input_paths(args.geno, args.ind, args.snp, args.pops)
+    helper.set_input_paths(args.geno, args.ind, args.snp, args.pops, args.models)
     helper.set_output_dir(args.outdir)
     helper.set_snp_cutoff(args.snp_cutoff)
-    helper.set_bootstrap(args.bootstrap)
+    helper.set_pairwise_complete(args.pairwise_complete)
+    helper.set_compact_snps(args.compact_snps)
+    helper.set_cache(args.cache, args.cache_dir, args.cache_size)
+    helper.set_bootstrap(args.bootstrap, args.bootstrap_replicates, args.bootstrap_seed)
+    helper.set_max_f4_points(args.max_f4_points)
+    helper.set_exclude_duplicates(args.exclude_duplicates)
+    helper.set_near_duplicate_f2(args.near_duplicate_f2)
+    helper.set_influence(args.influence)
+
+    if args.command == 'fstats':
+        helper.run_fstats(args.nprocs, args.f2, args.outgroup, args.target)
+        sys.exit(0)
+
+    if args.command == 'f4scan':
+        helper.run_f4_scan(args.nprocs, args.left, args.right, args.rank == 'angle', args.top)
+        sys.exit(0)
+
+    if args.command == 'scan':
+        helper.run_scan(args.nprocs, args.hybrid, args.aux, args.top)
+        sys.exit(0)
+
+    if args.models is not None:
+        helper.run_models(args.nprocs, args.f4_points)
+        sys.exit(0)
 
     helper.run(args.nprocs)
 
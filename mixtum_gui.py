@@ -17,13 +17,15 @@
 import sys
 from multiprocessing import freeze_support
 
-from gui.main_window import MainWindow
-
-from PySide6.QtWidgets import QApplication
-
 
 if __name__ == "__main__":
     freeze_support()
+
+    # Imported here so that spawned worker processes only import the computation kernels
+    from gui.main_window import MainWindow
+
+    from PySide6.QtWidgets import QApplication
+
     app = QApplication([])
     window = MainWindow()
     window.show()